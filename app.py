@@ -1,9 +1,17 @@
 import os
+import time
+import uuid
 from datetime import datetime, timezone, timedelta
 import requests
 from flask import Flask, request, jsonify, session, send_from_directory,redirect
 from dotenv import load_dotenv
-from supabase import create_client 
+from clientes import ClienteLazy
+from journal import Journal
+from busqueda import IndiceBusqueda
+from estadisticas import Estadisticas
+from estado import LockOcupado, crear_estado
+from lotes import Planificador
+from trazas import Trazas
 
 # cargar env
 load_dotenv()
@@ -14,10 +22,10 @@ if not SUPABASE_URL or not ANON_KEY or not SERVICE_KEY:
     raise RuntimeError(
         "Faltan variables de entorno SUPABASE_URL / SUPABASE_ANON_KEY / SUPABASE_SERVICE_ROLE_KEY"
     )
-# Cliente admin para backend
-supabase = create_client(SUPABASE_URL, SERVICE_KEY)
 # Bucket de fotos 
 BUCKET_FOTOS = os.getenv("SUPABASE_BUCKET_FOTOS", "observaciones")
+# Fotos descargadas de la cam que aún no se subieron a Storage
+FOTOS_SPOOL_DIR = os.getenv("FOTOS_SPOOL_DIR", "fotos_pendientes")
 # APP
 app = Flask(__name__, static_folder="static", static_url_path="")
 app.secret_key = os.getenv("SECRET_KEY", "dev-secret")
@@ -26,9 +34,31 @@ app.config.update(
     SESSION_COOKIE_SAMESITE="Lax",
     SESSION_COOKIE_SECURE=False,
 )
-# Clientes Supabase
-sb_auth = create_client(SUPABASE_URL, ANON_KEY)       
-sb_admin = create_client(SUPABASE_URL, SERVICE_KEY)   
+# Clientes Supabase (se construyen en el primer uso, uno por proceso)
+sb_auth = ClienteLazy(SUPABASE_URL, ANON_KEY)
+sb_admin = ClienteLazy(SUPABASE_URL, SERVICE_KEY)
+# Spans de latencia por observación (SQLite local)
+trazas = Trazas(os.getenv("TRAZAS_PATH", "trazas.db"))
+# Journal local: las escrituras de observaciones se confirman en disco
+# y se reenvían a Supabase en segundo plano
+journal = Journal(os.getenv("JOURNAL_PATH", "journal.db"), sb_admin, trazas=trazas)
+# Estado compartido entre workers (ESTADO_URL=redis://... con varios workers)
+estado = crear_estado()
+# Índice de búsqueda por objeto_celeste (en memoria, por usuario);
+# cada worker mantiene el suyo y se sincroniza por el canal "observaciones"
+indice_busqueda = IndiceBusqueda(
+    sb_admin,
+    pendientes=lambda: journal.pendientes("observacion", "upsert"),
+    ttl=float(os.getenv("INDICE_TTL_SEG", "600")),
+)
+estado.subscribe("observaciones", lambda m: indice_busqueda.agregar(
+    m["id_usuario"], m["id_observacion"], m["objeto_celeste"], m.get("fecha_inicio")))
+# Rollups de uso (SQLite local); el histórico se carga con `python estadisticas.py`
+estadisticas = Estadisticas(os.getenv("ESTADISTICAS_PATH", "estadisticas.db"))
+# la finalización es condicional (estado = "en curso"): solo cuenta la
+# escritura que de verdad la cerró, aunque llegue tarde desde el journal
+journal.al_aplicar("obs_finalizada", lambda fila: estadisticas.registrar_observacion(
+    fila.get("usuario_control"), fila.get("objeto_celeste")))
 def _now_utc_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
@@ -48,12 +78,13 @@ def _get_or_create_profile(email: str):
     }).execute()
 
     return created.data[0] if created.data else {"email": email, "nombre_usuario": email.split("@")[0]}
-def obtener_url_controlador(tipo: str) -> str:
-    res = sb_admin.table("telescopio_config") \
+def obtener_url_controlador(tipo: str, id_telescopio: int = None) -> str:
+    query = sb_admin.table("telescopio_config") \
         .select("host, puerto") \
-        .eq("tipo", tipo) \
-        .limit(1) \
-        .execute()
+        .eq("tipo", tipo)
+    if id_telescopio is not None:
+        query = query.eq("id_telescopio", id_telescopio)
+    res = query.limit(1).execute()
 
     if not res.data:
         raise RuntimeError(f"No existe configuración para tipo='{tipo}' en telescopio_config")
@@ -68,12 +99,20 @@ def obtener_url_controlador(tipo: str) -> str:
 
     return f"http://{host}:{puerto}"
 
-def subir_foto_y_guardar_path(id_observacion: str) -> str:
+def descargar_foto(id_observacion: str, id_telescopio: int = None, objeto: str = None) -> str:
+    """Baja la foto de la cam al toque y deja su subida en el journal.
+
+    El próximo /disparar pisa photo.jpg en la cam, así que la captura no
+    puede esperar a Supabase: se guarda en FOTOS_SPOOL_DIR y el hilo del
+    journal la sube a Storage (y escribe foto_path) cuando la fila ya está.
+    """
     # 1) URL dinámica desde BD 
-    cam_url = obtener_url_controlador("esp32_cam")
+    cam_url = obtener_url_controlador("esp32_cam", id_telescopio)
 
     # 2) Descargar la foto actual de la cam
-    r = requests.get(f"{cam_url}/photo.jpg", timeout=20)
+    with trazas.span(id_observacion, "camara_descarga", id_telescopio) as sp:
+        r = requests.get(f"{cam_url}/photo.jpg", timeout=20)
+        sp["bytes"] = len(r.content or b"")
     if r.status_code != 200:
         raise RuntimeError(f"No se pudo obtener photo.jpg de la cam (HTTP {r.status_code})")
 
@@ -81,15 +120,29 @@ def subir_foto_y_guardar_path(id_observacion: str) -> str:
     if not jpg_bytes or len(jpg_bytes) < 5000:
         raise RuntimeError("La cam devolvió un archivo vacío o muy pequeño (posible error)")
 
-    # 3) Obtener datos de la observación para nombre amigable
-    
-    obs = sb_admin.table("observacion") \
-        .select("objeto_celeste") \
-        .eq("id_observacion", id_observacion) \
-        .single() \
-        .execute()
-
-    objeto = (obs.data.get("objeto_celeste") or "astro") \
+    # 3) Guardar en disco antes que nada
+    os.makedirs(FOTOS_SPOOL_DIR, exist_ok=True)
+    archivo = os.path.join(FOTOS_SPOOL_DIR, f"{id_observacion}.jpg")
+    with open(archivo + ".tmp", "wb") as f:
+        f.write(jpg_bytes)
+    os.replace(archivo + ".tmp", archivo)
+
+    # 4) Nombre amigable (objeto de la observación)
+    if objeto is None:
+        objeto = journal.vista_pendiente("observacion").get(str(id_observacion), {}).get("objeto_celeste")
+    if objeto is None:
+        try:
+            with trazas.span(id_observacion, "db_lectura", id_telescopio):
+                obs = sb_admin.table("observacion") \
+                    .select("objeto_celeste") \
+                    .eq("id_observacion", id_observacion) \
+                    .limit(1) \
+                    .execute()
+            objeto = obs.data[0].get("objeto_celeste") if obs.data else None
+        except Exception as e:
+            print("No se pudo leer objeto_celeste para el nombre de la foto:", e)
+
+    objeto = (objeto or "astro") \
         .lower() \
         .replace(" ", "_")
 
@@ -98,21 +151,24 @@ def subir_foto_y_guardar_path(id_observacion: str) -> str:
 
     short_id = id_observacion.split("-")[0]
 
-    # 4) Path en Storage con nombre amigable
+    # 5) Path en Storage con nombre amigable
     foto_path = f"observaciones/{fecha}/{objeto}_{fecha}_obs_{short_id}.jpg"
 
-    # 5) Subir a Supabase Storage (upsert)
-    sb_admin.storage.from_(BUCKET_FOTOS).upload(
-        path=foto_path,
-        file=jpg_bytes,
-        file_options={"content-type": "image/jpeg", "upsert": "true"}
+    # 6) Subida a Storage y ruta en la tabla observacion, vía journal
+    # (en orden: después del insert de la observación)
+    journal.registrar(
+        BUCKET_FOTOS, "subir",
+        {"archivo": archivo, "path": foto_path, "content_type": "image/jpeg"},
+        clave=f"obs-foto-{id_observacion}",
+        ref=id_observacion,
+    )
+    journal.registrar(
+        "observacion", "update",
+        {"foto_path": foto_path},
+        filtro=[["id_observacion", str(id_observacion)]],
+        clave=f"obs-foto-path-{id_observacion}",
+        ref=id_observacion,
     )
-
-    # 6) Guardar ruta en la tabla observacion
-    sb_admin.table("observacion") \
-        .update({"foto_path": foto_path}) \
-        .eq("id_observacion", str(id_observacion)) \
-        .execute()
 
     return foto_path
 # STATIC 
@@ -217,6 +273,16 @@ def api_telescopios():
     return jsonify({"ok": True, "data": r.data})
 # SESIONES
 
+def _contar_sesiones(filas, fin: str):
+    # Rollups: solo las filas que devolvió un update condicional (estado = activa)
+    for ses in filas or []:
+        if not ses.get("inicio_sesion"):
+            continue
+        try:
+            estadisticas.registrar_sesion(ses["id_telescopio"], ses["id_usuario"], ses["inicio_sesion"], fin)
+        except Exception as e:
+            print("No se pudo actualizar estadísticas:", e)
+
 @app.post("/api/sesion/crear")
 def api_crear_sesion():
     err = _require_login()
@@ -233,11 +299,12 @@ def api_crear_sesion():
 
     try:
         # Finaliza sesión activa previa del usuario 
-        sb_admin.table("telescopio_sesion") \
+        r = sb_admin.table("telescopio_sesion") \
             .update({"estado": "finalizada", "fin_sesion": ahora, "disponible": True}) \
             .eq("id_usuario", session["user_id"]) \
             .eq("estado", "activa") \
             .execute()
+        _contar_sesiones(r.data, ahora)
 
         # Crea nueva sesión
         sb_admin.table("telescopio_sesion").insert({
@@ -283,11 +350,14 @@ def api_sesion_finalizar():
     ahora = _now_utc_iso()
 
     try:
-        sb_admin.table("telescopio_sesion") \
+        # condicional: si dos requests la cierran a la vez, solo una recibe la fila
+        r = sb_admin.table("telescopio_sesion") \
             .update({"estado": "finalizada", "fin_sesion": ahora, "disponible": True}) \
             .eq("id_sesion", id_sesion) \
+            .eq("estado", "activa") \
             .execute()
 
+        _contar_sesiones(r.data, ahora)
         return jsonify({"ok": True})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -319,7 +389,11 @@ def api_cola_fifo(id_telescopio):
         .order("timestamp_ingreso", desc=False) \
         .execute()
 
-    return jsonify({"ok": True, "data": r.data})
+    return jsonify({
+        "ok": True,
+        "data": r.data,
+        "ultima_asignacion": estado.get(f"cola:{id_telescopio}:ultima_asignacion"),
+    })
 
 @app.post("/api/cola/entrar")
 def api_cola_entrar():
@@ -336,30 +410,35 @@ def api_cola_entrar():
     id_usuario = session["user_id"]
 
     try:
-        # Evita duplicados
-        exist = sb_admin.table("queue") \
-            .select("id_queue") \
-            .eq("id_telescopio", id_telescopio) \
-            .eq("id_usuario", id_usuario) \
-            .limit(1) \
-            .execute()
+        with estado.lock(f"cola:{id_telescopio}"):
+            return _entrar_cola(id_telescopio, id_usuario)
+    except LockOcupado as e:
+        return jsonify({"ok": False, "error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
 
-        if exist.data:
-            return jsonify({"ok": False, "error": "ux_queue_telescopio_usuario"}), 409
+def _entrar_cola(id_telescopio: int, id_usuario):
+    # Evita duplicados
+    exist = sb_admin.table("queue") \
+        .select("id_queue") \
+        .eq("id_telescopio", id_telescopio) \
+        .eq("id_usuario", id_usuario) \
+        .limit(1) \
+        .execute()
 
-        ahora = datetime.now(timezone.utc).isoformat()
+    if exist.data:
+        return jsonify({"ok": False, "error": "ux_queue_telescopio_usuario"}), 409
 
-        ins = sb_admin.table("queue").insert({
-            "id_telescopio": id_telescopio,
-            "id_usuario": id_usuario,
-            "timestamp_ingreso": ahora,
-            "prioridad": "FIFO"   
-        }).execute()
+    ahora = datetime.now(timezone.utc).isoformat()
 
-        return jsonify({"ok": True, "data": ins.data[0] if ins.data else None})
+    ins = sb_admin.table("queue").insert({
+        "id_telescopio": id_telescopio,
+        "id_usuario": id_usuario,
+        "timestamp_ingreso": ahora,
+        "prioridad": "FIFO"   
+    }).execute()
 
-    except Exception as e:
-        return jsonify({"ok": False, "error": str(e)}), 500
+    return jsonify({"ok": True, "data": ins.data[0] if ins.data else None})
 
 
 @app.post("/api/cola/asignar")
@@ -379,54 +458,72 @@ def api_cola_asignar():
         return jsonify({"ok": False, "error": "id_telescopio inválido"}), 400
 
     try:
-        # 1) Tomar el primero de la cola FIFO
-        q = (
-            sb_admin.table("queue")
-            .select("*")
-            .eq("id_telescopio", id_telescopio)
-            .order("timestamp_ingreso", desc=False)
-            .limit(1)
-            .execute()
-        )
+        # Un solo worker asigna por telescopio a la vez
+        with estado.lock(f"cola:{id_telescopio}"):
+            return _asignar_siguiente(id_telescopio)
+    except LockOcupado as e:
+        return jsonify({"ok": False, "error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
 
-        if not q.data:
-            return jsonify({"ok": True, "data": None, "msg": "Cola vacía"})
+def _asignar_siguiente(id_telescopio: int):
+    # 1) Tomar el primero de la cola FIFO
+    q = (
+        sb_admin.table("queue")
+        .select("*")
+        .eq("id_telescopio", id_telescopio)
+        .order("timestamp_ingreso", desc=False)
+        .limit(1)
+        .execute()
+    )
 
-        next_item = q.data[0]
-        id_usuario = next_item["id_usuario"]
-        id_queue = next_item["id_queue"]
+    if not q.data:
+        return jsonify({"ok": True, "data": None, "msg": "Cola vacía"})
 
-        # 2) Sacarlo de la cola
-        sb_admin.table("queue").delete().eq("id_queue", id_queue).execute()
+    next_item = q.data[0]
+    id_usuario = next_item["id_usuario"]
+    id_queue = next_item["id_queue"]
 
-        # 3) Ver si la cola quedó vacía (para decidir ILIMITADO vs 10 min)
-        resto = (
-            sb_admin.table("queue")
-            .select("id_queue")
-            .eq("id_telescopio", id_telescopio)
-            .limit(1)
-            .execute()
-        )
+    # 2) Sacarlo de la cola
+    sb_admin.table("queue").delete().eq("id_queue", id_queue).execute()
 
-        ahora = datetime.now(timezone.utc)
+    # 3) Ver si la cola quedó vacía (para decidir ILIMITADO vs 10 min)
+    resto = (
+        sb_admin.table("queue")
+        .select("id_queue")
+        .eq("id_telescopio", id_telescopio)
+        .limit(1)
+        .execute()
+    )
 
-        # Si todavía hay cola tiene 10 min, si no hay cola tiene ilimitado
-        fin_sesion = (ahora + timedelta(minutes=10)).isoformat() if resto.data else None
+    ahora = datetime.now(timezone.utc)
 
-        # 4) Crear sesión activa para el usuario asignado
-        ins = sb_admin.table("telescopio_sesion").insert({
-            "id_telescopio": id_telescopio,
-            "id_usuario": id_usuario,
-            "inicio_sesion": ahora.isoformat(),
-            "fin_sesion": fin_sesion, 
-            "estado": "activa",
-            "disponible": True         
-        }).execute()
+    # Si todavía hay cola tiene 10 min, si no hay cola tiene ilimitado
+    fin_sesion = (ahora + timedelta(minutes=10)).isoformat() if resto.data else None
 
-        return jsonify({"ok": True, "data": ins.data[0] if ins.data else None})
+    # 4) Crear sesión activa para el usuario asignado
+    ins = sb_admin.table("telescopio_sesion").insert({
+        "id_telescopio": id_telescopio,
+        "id_usuario": id_usuario,
+        "inicio_sesion": ahora.isoformat(),
+        "fin_sesion": fin_sesion, 
+        "estado": "activa",
+        "disponible": True         
+    }).execute()
 
+    # 5) Rollup de espera en cola
+    try:
+        estadisticas.registrar_espera(id_telescopio, next_item["timestamp_ingreso"], ahora.isoformat())
     except Exception as e:
-        return jsonify({"ok": False, "error": str(e)}), 500
+        print("No se pudo actualizar estadísticas:", e)
+
+    # 6) Avisar al resto de workers
+    sesion_nueva = ins.data[0] if ins.data else None
+    asignacion = {"id_telescopio": id_telescopio, "id_usuario": id_usuario, "asignado_el": ahora.isoformat()}
+    estado.set(f"cola:{id_telescopio}:ultima_asignacion", asignacion)
+    estado.publish("cola", asignacion)
+
+    return jsonify({"ok": True, "data": sesion_nueva})
 
 @app.post("/api/acceso/solicitar")
 def api_acceso_solicitar():
@@ -441,6 +538,13 @@ def api_acceso_solicitar():
 
     user_id = session["user_id"]
 
+    try:
+        with estado.lock(f"cola:{id_telescopio}"):
+            return _solicitar_acceso(id_telescopio, user_id)
+    except LockOcupado as e:
+        return jsonify({"ok": False, "error": str(e)}), 409
+
+def _solicitar_acceso(id_telescopio: int, user_id):
     # 1) Ver si hay sesión activa en ese telescopio
     activa = (
         sb_admin.table("telescopio_sesion")
@@ -516,10 +620,17 @@ def api_acceso_solicitar():
         "msg": "Telescopio ocupado. Entraste a la cola FIFO."
     })
 
-@app.get("/api/observacion/activa/<uuid:id_sesion>")
-def api_observacion_activa(id_sesion):
-    if "email" not in session:
-        return jsonify({"ok": False, "error": "No auth"}), 401
+def _observacion_en_curso(id_sesion):
+    """Observación en curso más reciente de la sesión, contando lo que aún
+    espera en el journal (insert sin llegar a Supabase o finalización
+    pendiente)."""
+    vista = journal.vista_pendiente("observacion")
+    pendientes = [
+        d for d in vista.values()
+        if d.get("id_sesion") == str(id_sesion) and d.get("estado") == "en curso"
+    ]
+    if pendientes:
+        return max(pendientes, key=lambda d: d.get("fecha_inicio") or "")
 
     r = sb_admin.table("observacion") \
         .select("*") \
@@ -528,8 +639,20 @@ def api_observacion_activa(id_sesion):
         .order("fecha_inicio", desc=True) \
         .limit(1) \
         .execute()
+    if not r.data:
+        return None
+    obs = r.data[0]
+    # ya se finalizó, solo que el update sigue en el journal
+    if vista.get(str(obs["id_observacion"]), {}).get("estado") == "finalizada":
+        return None
+    return obs
 
-    return jsonify({"ok": True, "data": r.data[0] if r.data else None})
+@app.get("/api/observacion/activa/<uuid:id_sesion>")
+def api_observacion_activa(id_sesion):
+    if "email" not in session:
+        return jsonify({"ok": False, "error": "No auth"}), 401
+
+    return jsonify({"ok": True, "data": _observacion_en_curso(id_sesion)})
 @app.post("/api/observacion/finalizar")
 def api_observacion_finalizar():
     # auth
@@ -550,37 +673,39 @@ def api_observacion_finalizar():
         if not id_sesion:
             return jsonify({"ok": False, "error": "Falta id_observacion o id_sesion"}), 400
 
-        r = sb_admin.table("observacion") \
-            .select("id_observacion") \
-            .eq("id_sesion", str(id_sesion)) \
-            .eq("estado", "en curso") \
-            .order("fecha_inicio", desc=True) \
-            .limit(1) \
-            .execute()
-
-        if not r.data:
+        obs = _observacion_en_curso(id_sesion)
+        if not obs:
             return jsonify({"ok": False, "error": "No hay observación en curso para esa sesión"}), 404
-
-        id_observacion = r.data[0]["id_observacion"]
+        id_observacion = obs["id_observacion"]
+        objeto = obs.get("objeto_celeste")
+    else:
+        objeto = None
 
     # 1) Finaliza (esto NO debe fallar por la foto)
-    sb_admin.table("observacion") \
-        .update({"estado": "finalizada", "fecha_fin": ahora}) \
-        .eq("id_observacion", id_observacion) \
-        .execute()
+    with trazas.span(id_observacion, "finalizar"):
+        journal.registrar(
+            "observacion", "update",
+            {"estado": "finalizada", "fecha_fin": ahora},
+            filtro=[["id_observacion", str(id_observacion)], ["estado", "en curso"]],
+            clave=f"obs-finalizar-{id_observacion}",
+            ref=id_observacion,
+            evento="obs_finalizada",
+        )
 
-    # 2) Intentar subir foto
+    # 2) Bajar la foto ya (la subida a Storage queda en el journal)
     warning = None
     try:
-        foto_path = subir_foto_y_guardar_path(str(id_observacion))
-        print("Foto subida OK:", foto_path)
+        foto_path = descargar_foto(str(id_observacion), objeto=objeto)
+        print("Foto guardada, subida en cola:", foto_path)
     except Exception as e:
-        warning = f"No se pudo subir foto: {str(e)}"
+        warning = f"No se pudo obtener la foto: {str(e)}"
         print(warning)
-        sb_admin.table("observacion") \
-            .update({"descripcion": warning}) \
-            .eq("id_observacion", id_observacion) \
-            .execute()
+        journal.registrar(
+            "observacion", "update",
+            {"descripcion": warning},
+            filtro=[["id_observacion", str(id_observacion)]],
+            ref=id_observacion,
+        )
 
     return jsonify({"ok": True, "id_observacion": id_observacion, "warning": warning})
 
@@ -617,7 +742,12 @@ def api_observacion_en_curso():
     if not id_sesion or not objeto:
         return jsonify({"ok": False, "error": "Falta id_sesion u objeto_celeste"}), 400
 
+    # el id se genera aquí (nunca del cliente) para poder responder sin
+    # esperar a Supabase
+    id_observacion = str(uuid.uuid4())
+
     payload = {
+        "id_observacion": id_observacion,
         "id_sesion": str(id_sesion),
         "objeto_celeste": objeto,
         "fecha_inicio": data.get("fecha_inicio") or datetime.now(timezone.utc).isoformat(),
@@ -631,19 +761,28 @@ def api_observacion_en_curso():
     }
     payload = {k: v for k, v in payload.items() if v is not None}
 
-    # Insertar
-    sb_admin.table("observacion").insert(payload).execute()
-
-    # Reconsultar y devolver la observación activa real
-    r = sb_admin.table("observacion") \
-        .select("*") \
-        .eq("id_sesion", str(id_sesion)) \
-        .eq("estado", "en curso") \
-        .order("fecha_inicio", desc=True) \
-        .limit(1) \
-        .execute()
+    # Telescopio opcional: solo para agrupar las trazas
+    try:
+        id_telescopio = int(data["id_telescopio"]) if data.get("id_telescopio") is not None else None
+    except Exception:
+        id_telescopio = None
+
+    # Insertar vía journal (upsert por id: reintentar no duplica)
+    with trazas.span(id_observacion, "en_curso", id_telescopio):
+        journal.registrar(
+            "observacion", "upsert", payload,
+            conflicto="id_observacion",
+            clave=f"obs-insert-{id_observacion}",
+            ref=id_observacion,
+        )
+    estado.publish("observaciones", {
+        "id_usuario": session["user_id"],
+        "id_observacion": id_observacion,
+        "objeto_celeste": objeto,
+        "fecha_inicio": payload["fecha_inicio"],
+    })
 
-    return jsonify({"ok": True, "data": r.data[0] if r.data else None})
+    return jsonify({"ok": True, "data": payload})
 
 
 # CONFIGURACIPÓN TELESCOPIO 
@@ -739,6 +878,79 @@ def api_observacion_foto(id_observacion):
 
     return redirect(signed_url, code=302)
 
+# Trozos de ids por request: el filtro in.() viaja en la URL
+LOTE_IDS = 150
+
+def _buscar_por_ids(armar_query, ids, limite=200):
+    """Trae observaciones por lotes de ids (ya ordenados) hasta juntar limite."""
+    items = []
+    for i in range(0, len(ids), LOTE_IDS):
+        r = armar_query().in_("id_observacion", ids[i:i + LOTE_IDS]).execute()
+        items.extend(r.data or [])
+        if len(items) >= limite:
+            break
+    items.sort(key=lambda o: o.get("fecha_inicio") or "", reverse=True)
+    return items[:limite]
+
+@app.get("/api/observaciones/autocompletar")
+def api_observaciones_autocompletar():
+    err = _require_login()
+    if err:
+        return err
+
+    q = request.args.get("q", "").strip()
+    try:
+        limite = int(request.args.get("limite") or 10)
+    except Exception:
+        return jsonify({"ok": False, "error": "limite inválido"}), 400
+
+    items = indice_busqueda.autocompletar(session["user_id"], q, limite)
+    return jsonify({"ok": True, "items": items})
+
+def _duenio_observacion(id_observacion):
+    """usuario_control de la observación (también si aún está en el journal),
+    o None si no existe."""
+    pendiente = journal.vista_pendiente("observacion").get(str(id_observacion), {})
+    if pendiente.get("usuario_control"):
+        return str(pendiente["usuario_control"])
+
+    r = sb_admin.table("observacion") \
+        .select("usuario_control") \
+        .eq("id_observacion", str(id_observacion)) \
+        .limit(1) \
+        .execute()
+    return str(r.data[0].get("usuario_control")) if r.data else None
+
+@app.get("/api/observacion/<id_observacion>/trazas")
+def api_observacion_trazas(id_observacion):
+    err = _require_login()
+    if err:
+        return err
+
+    duenio = _duenio_observacion(id_observacion)
+    if duenio is None:
+        return jsonify({"ok": False, "error": "Observación no encontrada"}), 404
+
+    if duenio != str(session["user_id"]):
+        return jsonify({"ok": False, "error": "No autorizado"}), 403
+
+    spans = trazas.cascada(id_observacion)
+    total = max((s["offset_ms"] + s["duracion_ms"] for s in spans), default=0)
+    return jsonify({"ok": True, "data": {"total_ms": total, "spans": spans}})
+
+@app.get("/api/trazas/resumen")
+def api_trazas_resumen():
+    err = _require_login()
+    if err:
+        return err
+
+    try:
+        horas = float(request.args.get("horas") or 24)
+    except Exception:
+        return jsonify({"ok": False, "error": "horas inválido"}), 400
+
+    return jsonify({"ok": True, "data": trazas.resumen(horas * 3600)})
+
 @app.get("/api/observaciones/mias")
 def api_listar_observaciones_mias():
     err = _require_login()
@@ -746,29 +958,32 @@ def api_listar_observaciones_mias():
         return err
 
     q = request.args.get("q", "").strip()
-    estado = request.args.get("estado", "").strip()
+    estado_filtro = request.args.get("estado", "").strip()
     desde = request.args.get("desde", "").strip()
     hasta = request.args.get("hasta", "").strip()
 
-    query = sb_admin.table("observacion").select(
-        "id_observacion,objeto_celeste,fecha_inicio,fecha_fin,estado,coord_azimut,coord_altitud,foto_path"
-    ).eq("usuario_control", session["user_id"]) \
-     .order("fecha_inicio", desc=True).limit(200)
+    def armar_query():
+        query = sb_admin.table("observacion").select(
+            "id_observacion,objeto_celeste,fecha_inicio,fecha_fin,estado,coord_azimut,coord_altitud,foto_path"
+        ).eq("usuario_control", session["user_id"]) \
+         .order("fecha_inicio", desc=True).limit(200)
 
-    if estado:
-        query = query.eq("estado", estado)
+        if estado_filtro:
+            query = query.eq("estado", estado_filtro)
 
-    if q:
-        # búsqueda simple por objeto_celeste
-        query = query.ilike("objeto_celeste", f"%{q}%")
+        if desde:
+            query = query.gte("fecha_inicio", desde)
 
-    if desde:
-        query = query.gte("fecha_inicio", desde)
+        if hasta:
+            query = query.lte("fecha_inicio", hasta)
+        return query
 
-    if hasta:
-        query = query.lte("fecha_inicio", hasta)
+    if q:
+        # búsqueda por objeto_celeste en el índice, luego traer por ids
+        ids = indice_busqueda.buscar(session["user_id"], q)
+        return jsonify({"ok": True, "items": _buscar_por_ids(armar_query, ids)})
 
-    r = query.execute()
+    r = armar_query().execute()
     return jsonify({"ok": True, "items": r.data or []})
 
 
@@ -779,33 +994,38 @@ def api_listar_observaciones():
         return jsonify({"ok": False, "error": "No auth"}), 401
 
     q = (request.args.get("q") or "").strip().lower()
-    estado = (request.args.get("estado") or "").strip()
+    estado_filtro = (request.args.get("estado") or "").strip()
     desde = (request.args.get("desde") or "").strip()  
     hasta = (request.args.get("hasta") or "").strip()  
 
-    query = sb_admin.table("observacion").select(
-    "id_observacion,objeto_celeste,fecha_inicio,fecha_fin,estado,coord_azimut,coord_altitud,foto_path,usuario_control"
-).eq("usuario_control", session["user_id"]) \
- .order("fecha_inicio", desc=True).limit(200)
+    def armar_query():
+        query = sb_admin.table("observacion").select(
+        "id_observacion,objeto_celeste,fecha_inicio,fecha_fin,estado,coord_azimut,coord_altitud,foto_path,usuario_control"
+    ).eq("usuario_control", session["user_id"]) \
+     .order("fecha_inicio", desc=True).limit(200)
 
-    if estado:
-        query = query.eq("estado", estado)
+        if estado_filtro:
+            query = query.eq("estado", estado_filtro)
 
-    if desde:
-        query = query.gte("fecha_inicio", f"{desde}T00:00:00")
+        if desde:
+            query = query.gte("fecha_inicio", f"{desde}T00:00:00")
 
-    if hasta:
-        query = query.lte("fecha_inicio", f"{hasta}T23:59:59")
+        if hasta:
+            query = query.lte("fecha_inicio", f"{hasta}T23:59:59")
+        return query
 
-    res = query.execute()
-    data = res.data or []
     if q:
-        data = [o for o in data if (o.get("objeto_celeste") or "").lower().find(q) >= 0]
+        ids = indice_busqueda.buscar(session["user_id"], q)
+        return jsonify({"ok": True, "items": _buscar_por_ids(armar_query, ids)})
 
-
-    return jsonify({"ok": True, "items": data})
+    res = armar_query().execute()
+    return jsonify({"ok": True, "items": res.data or []})
 @app.route("/api/observacion/coords", methods=["POST"])
 def observacion_coords():
+    err = _require_login()
+    if err:
+        return err
+
     payload = request.get_json(force=True) or {}
     id_obs = payload.get("id_observacion")
     az = payload.get("coord_azimut")
@@ -814,17 +1034,212 @@ def observacion_coords():
     if not id_obs:
         return jsonify(ok=False, error="Falta id_observacion"), 400
 
-    # Actualiza en DB
+    # solo el dueño puede escribir coordenadas y tiempos de su observación
+    duenio = _duenio_observacion(id_obs)
+    if duenio is None:
+        return jsonify(ok=False, error="Observación no encontrada"), 404
+    if duenio != str(session["user_id"]):
+        return jsonify(ok=False, error="No autorizado"), 403
+
+    # El navegador llama /apuntar directo al ESP32 y nos informa cuánto tardó
+    try:
+        dur_apuntar = float(payload["duracion_apuntar_ms"]) if payload.get("duracion_apuntar_ms") is not None else None
+        id_telescopio = int(payload["id_telescopio"]) if payload.get("id_telescopio") is not None else None
+    except Exception:
+        dur_apuntar, id_telescopio = None, None
+    if dur_apuntar is not None:
+        trazas.registrar(id_obs, "apuntar", time.time() - dur_apuntar / 1000.0, dur_apuntar,
+                         id_telescopio=id_telescopio, origen="navegador")
+
+    # Actualiza en DB (vía journal)
     try:
-        res = supabase.table("observacion").update({
-            "coord_azimut": az,
-            "coord_altitud": alt
-        }).eq("id_observacion", id_obs).execute()
+        with trazas.span(id_obs, "coords", id_telescopio):
+            journal.registrar(
+                "observacion", "update",
+                {"coord_azimut": az, "coord_altitud": alt},
+                filtro=[["id_observacion", str(id_obs)]],
+                ref=id_obs,
+            )
 
         return jsonify(ok=True, updated=True)
     except Exception as e:
         return jsonify(ok=False, error=str(e)), 500
 
+
+# LOTES (observación desatendida por telescopio)
+
+def _sesion_vigente(id_sesion, id_usuario) -> bool:
+    # la sesión sigue activa, es del usuario y no pasó su fin_sesion
+    r = sb_admin.table("telescopio_sesion") \
+        .select("fin_sesion") \
+        .eq("id_sesion", id_sesion) \
+        .eq("id_usuario", str(id_usuario)) \
+        .eq("estado", "activa") \
+        .limit(1) \
+        .execute()
+    if not r.data:
+        return False
+    fin = r.data[0].get("fin_sesion")
+    return not fin or datetime.fromisoformat(fin.replace("Z", "+00:00")) > datetime.now(timezone.utc)
+
+planificador = Planificador(
+    journal, estado, obtener_url_controlador, descargar_foto,
+    hilos_por_dispositivo=int(os.getenv("LOTE_HILOS_POR_TELESCOPIO", "1")),
+    estabilizar_seg=float(os.getenv("LOTE_ESTABILIZAR_SEG", "8")),
+    trazas=trazas,
+    sesion_vigente=_sesion_vigente,
+)
+
+@app.post("/api/lotes")
+def api_lote_crear():
+    err = _require_login()
+    if err:
+        return err
+
+    # { "objetivos": { "<id_telescopio>": ["M42", "Vega", ...], ... } }
+    data = request.get_json(force=True) or {}
+    objetivos = data.get("objetivos")
+    if not isinstance(objetivos, dict) or not objetivos:
+        return jsonify({"ok": False, "error": "Falta objetivos"}), 400
+
+    por_telescopio = {}
+    try:
+        for id_tel, lista in objetivos.items():
+            nombres = [" ".join(str(o).split()) for o in (lista or []) if str(o).strip()]
+            if nombres:
+                por_telescopio[int(id_tel)] = nombres
+    except Exception:
+        return jsonify({"ok": False, "error": "id_telescopio inválido"}), 400
+
+    if not por_telescopio:
+        return jsonify({"ok": False, "error": "Falta objetivos"}), 400
+
+    # El usuario debe tener la sesión activa de cada telescopio
+    sesiones = {}
+    for id_telescopio in por_telescopio:
+        r = sb_admin.table("telescopio_sesion") \
+            .select("id_sesion,id_usuario") \
+            .eq("id_telescopio", id_telescopio) \
+            .eq("estado", "activa") \
+            .order("inicio_sesion", desc=True) \
+            .limit(1) \
+            .execute()
+        ses = r.data[0] if r.data else None
+        if not ses or str(ses.get("id_usuario")) != str(session["user_id"]):
+            return jsonify({"ok": False, "error": f"Sin sesión activa en telescopio {id_telescopio}"}), 403
+        sesiones[id_telescopio] = ses["id_sesion"]
+
+    id_lote = planificador.crear_lote(session["user_id"], por_telescopio, sesiones)
+    return jsonify({"ok": True, "data": planificador.progreso(id_lote)})
+
+@app.get("/api/lotes/<id_lote>")
+def api_lote_progreso(id_lote):
+    err = _require_login()
+    if err:
+        return err
+
+    lote = planificador.progreso(id_lote)
+    if not lote:
+        return jsonify({"ok": False, "error": "Lote no encontrado"}), 404
+    if str(lote.get("id_usuario")) != str(session["user_id"]):
+        return jsonify({"ok": False, "error": "No autorizado"}), 403
+
+    return jsonify({"ok": True, "data": lote})
+
+
+# ESTADÍSTICAS
+
+@app.get("/api/estadisticas")
+def api_estadisticas():
+    err = _require_login()
+    if err:
+        return err
+
+    user_id = session["user_id"]
+    data = {
+        "usuario": {
+            "objetos": estadisticas.leer(f"usuario:{user_id}:objetos") or {},
+            "sesion_min": estadisticas.leer(f"usuario:{user_id}:sesion_min"),
+        },
+        "global": {
+            "objetos": estadisticas.leer("global:objetos") or {},
+        },
+    }
+
+    id_telescopio = request.args.get("id_telescopio")
+    if id_telescopio:
+        try:
+            id_telescopio = int(id_telescopio)
+        except Exception:
+            return jsonify({"ok": False, "error": "id_telescopio inválido"}), 400
+        data["telescopio"] = {
+            "id_telescopio": id_telescopio,
+            "sesion_min": estadisticas.leer(f"telescopio:{id_telescopio}:sesion_min"),
+            "espera_seg": estadisticas.leer(f"telescopio:{id_telescopio}:espera_seg"),
+        }
+
+    return jsonify({"ok": True, "data": data})
+
+
+# VISIBILIDAD (catálogo de objetos para esta noche)
+
+# Sitio por defecto si el telescopio no tiene latitud/longitud (Lima)
+SITIO_LAT = float(os.getenv("SITIO_LAT", "-12.0464"))
+SITIO_LON = float(os.getenv("SITIO_LON", "-77.0428"))
+_visibilidad = None
+
+def _obtener_visibilidad():
+    # import diferido: numpy no se carga al arrancar
+    global _visibilidad
+    if _visibilidad is None:
+        from catalogo import Visibilidad, cargar_catalogo
+        _visibilidad = Visibilidad(cargar_catalogo(os.getenv("CATALOGO_PATH")))
+    return _visibilidad
+
+@app.get("/api/catalogo/visibles/<int:id_telescopio>")
+def api_catalogo_visibles(id_telescopio):
+    err = _require_login()
+    if err:
+        return err
+
+    try:
+        alt_min = float(request.args.get("alt_min") or 0)
+        limite = int(request.args.get("limite") or 100)
+    except Exception:
+        return jsonify({"ok": False, "error": "alt_min o limite inválido"}), 400
+    # ?solo_noche=0 incluye el día (pruebas con el domo a plena luz)
+    solo_noche = request.args.get("solo_noche", "1") not in ("0", "false")
+
+    # todos los sitios de la flota en una sola pasada (y una sola entrada de caché)
+    r = sb_admin.table("telescopio") \
+        .select("*") \
+        .order("id_telescopio") \
+        .execute()
+
+    sitios = {}
+    for tel in r.data or []:
+        lat = tel.get("latitud")
+        lon = tel.get("longitud")
+        sitios[tel["id_telescopio"]] = (
+            SITIO_LAT if lat is None else float(lat),
+            SITIO_LON if lon is None else float(lon),
+        )
+    lat, lon = sitios.setdefault(id_telescopio, (SITIO_LAT, SITIO_LON))
+    items = _obtener_visibilidad().visibles(
+        lat, lon, alt_min=alt_min, limite=limite,
+        sitios=sorted(set(sitios.values())), solo_noche=solo_noche,
+    )
+    return jsonify({"ok": True, "data": items})
+
+
+@app.get("/api/journal/estado")
+def api_journal_estado():
+    err = _require_login()
+    if err:
+        return err
+
+    return jsonify({"ok": True, "data": journal.metricas()})
+
 # ======================
 # MAIN
 # ======================
@@ -0,0 +1,179 @@
+import bisect
+import threading
+import time
+import unicodedata
+
+# Índice en memoria por usuario sobre objeto_celeste.
+# Trigramas para búsqueda por subcadena y lista ordenada de palabras para
+# prefijos (autocompletar). Se construye la primera vez que el usuario
+# busca y se actualiza al insertar observaciones (también las que llegan
+# mientras se construye y las que aún esperan en el journal). Cada tanto
+# se reconstruye, por si el worker se perdió algún mensaje.
+
+PAGINA = 1000
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sin tildes y con espacios simples."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
+    return " ".join(texto.lower().split())
+
+
+def _trigramas(texto: str):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceUsuario:
+    # Se indexan nombres distintos (pocos aunque haya miles de observaciones)
+    # y cada nombre apunta a sus ids.
+
+    def __init__(self):
+        self.ids = {}          # nombre normalizado -> set(id_observacion)
+        self.originales = {}   # nombre normalizado -> texto tal como se escribió
+        self.trigramas = {}    # trigrama -> set(nombre normalizado)
+        self.palabras = []     # [(palabra, nombre normalizado)] ordenada
+        self.fechas = {}       # id_observacion -> fecha_inicio (ISO)
+
+    def agregar(self, id_observacion: str, objeto: str, fecha_inicio: str = None):
+        norm = normalizar(objeto)
+        if not norm:
+            return
+
+        ids = self.ids.get(norm)
+        if ids is None:
+            ids = self.ids[norm] = set()
+            self.originales[norm] = " ".join(objeto.split())
+            for tri in _trigramas(norm):
+                self.trigramas.setdefault(tri, set()).add(norm)
+            for palabra in set(norm.split()):
+                bisect.insort(self.palabras, (palabra, norm))
+        ids.add(str(id_observacion))
+        self.fechas[str(id_observacion)] = fecha_inicio or ""
+
+    def _nombres_por_prefijo(self, prefijo: str) -> set:
+        i = bisect.bisect_left(self.palabras, (prefijo, ""))
+        nombres = set()
+        while i < len(self.palabras) and self.palabras[i][0].startswith(prefijo):
+            nombres.add(self.palabras[i][1])
+            i += 1
+        return nombres
+
+    def _nombres(self, q: str) -> set:
+        if len(q) < 3:
+            # sin trigramas: recorrido lineal sobre los nombres distintos
+            return {n for n in self.ids if q in n}
+
+        # intersección empezando por la lista más corta
+        listas = sorted((self.trigramas.get(t, set()) for t in _trigramas(q)), key=len)
+        nombres = set(listas[0])
+        for otra in listas[1:]:
+            if not nombres:
+                break
+            nombres &= otra
+        # los trigramas pueden coincidir en desorden: verificar la subcadena
+        return {n for n in nombres if q in n}
+
+    def buscar(self, q: str) -> list:
+        """ids cuya objeto_celeste contiene q, los más recientes primero."""
+        q = normalizar(q)
+        if not q:
+            return []
+        ids = set()
+        for n in self._nombres(q):
+            ids |= self.ids[n]
+        return sorted(ids, key=lambda i: self.fechas[i], reverse=True)
+
+    def autocompletar(self, q: str, limite: int = 10) -> list:
+        """Nombres distintos que empiezan con q, los más observados primero."""
+        q = normalizar(q)
+        if not q:
+            return []
+
+        nombres = {n for n in self._nombres_por_prefijo(q.split()[-1]) if q in n}
+        orden = sorted(nombres, key=lambda n: (-len(self.ids[n]), n))[:limite]
+        return [self.originales[n] for n in orden]
+
+
+class IndiceBusqueda:
+    def __init__(self, cliente, pendientes=None, ttl: float = 600.0):
+        self.cliente = cliente
+        self.pendientes = pendientes    # () -> [datos] de inserts aún en el journal
+        self.ttl = ttl                  # se reconstruye pasado este tiempo (por si se perdió un mensaje)
+        self._lock = threading.Lock()
+        self._indices = {}              # id_usuario -> (IndiceUsuario, construido_en)
+        self._construyendo = {}         # id_usuario -> [buffer por carga en curso]
+
+    def _construir(self, id_usuario: str) -> IndiceUsuario:
+        idx = IndiceUsuario()
+        # antes que Supabase: si una entrada se aplica entre ambas lecturas
+        # aparece dos veces (mismo id, no duplica) en vez de ninguna
+        if self.pendientes is not None:
+            for row in self.pendientes():
+                if str(row.get("usuario_control")) == id_usuario:
+                    idx.agregar(row["id_observacion"], row.get("objeto_celeste"), row.get("fecha_inicio"))
+
+        desde = 0
+        while True:
+            r = self.cliente.table("observacion") \
+                .select("id_observacion,objeto_celeste,fecha_inicio") \
+                .eq("usuario_control", id_usuario) \
+                .order("id_observacion") \
+                .range(desde, desde + PAGINA - 1) \
+                .execute()
+            filas = r.data or []
+            for row in filas:
+                idx.agregar(row["id_observacion"], row.get("objeto_celeste"), row.get("fecha_inicio"))
+            if len(filas) < PAGINA:
+                return idx
+            desde += PAGINA
+
+    def indice(self, id_usuario) -> IndiceUsuario:
+        id_usuario = str(id_usuario)
+        with self._lock:
+            item = self._indices.get(id_usuario)
+            if item is not None and time.monotonic() - item[1] < self.ttl:
+                return item[0]
+            buffer = []
+            self._construyendo.setdefault(id_usuario, []).append(buffer)
+
+        construido_en = time.monotonic()
+        try:
+            idx = self._construir(id_usuario)
+        finally:
+            with self._lock:
+                cargas = self._construyendo[id_usuario]
+                cargas.remove(buffer)
+                if not cargas:
+                    del self._construyendo[id_usuario]
+
+        with self._lock:
+            # inserts publicados mientras se leía Supabase
+            for args in buffer:
+                idx.agregar(*args)
+            # si otro hilo lo reconstruyó mientras tanto, se queda el más nuevo
+            actual = self._indices.get(id_usuario)
+            if actual is None or actual[1] < construido_en:
+                self._indices[id_usuario] = (idx, construido_en)
+            return self._indices[id_usuario][0]
+
+    def agregar(self, id_usuario, id_observacion, objeto: str, fecha_inicio: str = None):
+        # si el índice aún no existe no hace falta: se construirá completo;
+        # las cargas en curso lo reciben al terminar
+        id_usuario = str(id_usuario)
+        with self._lock:
+            item = self._indices.get(id_usuario)
+            if item is not None:
+                item[0].agregar(id_observacion, objeto, fecha_inicio)
+            for buffer in self._construyendo.get(id_usuario, []):
+                buffer.append((id_observacion, objeto, fecha_inicio))
+
+    def buscar(self, id_usuario, q: str) -> list:
+        idx = self.indice(id_usuario)
+        with self._lock:
+            return idx.buscar(q)
+
+    def autocompletar(self, id_usuario, q: str, limite: int = 10) -> list:
+        idx = self.indice(id_usuario)
+        with self._lock:
+            return idx.autocompletar(q, limite)
@@ -0,0 +1,302 @@
+import csv
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+
+# Catálogo de objetos de cielo profundo / estrellas con RA/Dec fijas (J2000).
+# Calcula alt/az de todo el catálogo, para todos los sitios, sobre una grilla
+# de 24 h (de mediodía a mediodía) en una sola pasada vectorizada y lo cachea.
+# La noche es la parte de la grilla con el Sol bajo ALT_SOL_NOCHE (crepúsculo
+# náutico), calculado sobre la misma grilla.
+# Los planetas no van aquí: su RA/Dec cambia y los resuelve el ESP32.
+# No se aplica precesión (~0.3° desde J2000), suficiente para saber si un
+# objeto está sobre el horizonte.
+
+PASO_MIN = 5
+HORAS_GRILLA = 24
+ALT_SOL_NOCHE = -12.0
+
+# nombre, RA (horas), Dec (grados)
+_CATALOGO_BASE = [
+    ("Sirio", 6.7525, -16.716),
+    ("Canopus", 6.3992, -52.696),
+    ("Arturo", 14.2610, 19.182),
+    ("Vega", 18.6156, 38.784),
+    ("Capella", 5.2782, 45.998),
+    ("Rigel", 5.2423, -8.202),
+    ("Proción", 7.6550, 5.225),
+    ("Betelgeuse", 5.9195, 7.407),
+    ("Achernar", 1.6286, -57.237),
+    ("Altair", 19.8464, 8.868),
+    ("Aldebarán", 4.5987, 16.509),
+    ("Antares", 16.4901, -26.432),
+    ("Espiga", 13.4199, -11.161),
+    ("Pólux", 7.7553, 28.026),
+    ("Fomalhaut", 22.9608, -29.622),
+    ("Deneb", 20.6905, 45.280),
+    ("Régulo", 10.1395, 11.967),
+    ("Alfa Centauri", 14.6600, -60.834),
+    ("Acrux", 12.4433, -63.099),
+    ("Polaris", 2.5300, 89.264),
+    ("M1 Nebulosa del Cangrejo", 5.5750, 22.014),
+    ("M6 Cúmulo de la Mariposa", 17.6680, -32.253),
+    ("M7 Cúmulo de Ptolomeo", 17.8970, -34.793),
+    ("M8 Nebulosa de la Laguna", 18.0630, -24.383),
+    ("M13 Cúmulo de Hércules", 16.6950, 36.460),
+    ("M22", 18.6070, -23.905),
+    ("M31 Galaxia de Andrómeda", 0.7123, 41.269),
+    ("M42 Nebulosa de Orión", 5.5880, -5.391),
+    ("M44 El Pesebre", 8.6670, 19.670),
+    ("M45 Pléyades", 3.7900, 24.117),
+    ("M51 Galaxia del Remolino", 13.4979, 47.195),
+    ("M57 Nebulosa del Anillo", 18.8930, 33.029),
+    ("M104 Galaxia del Sombrero", 12.6660, -11.623),
+    ("Omega Centauri", 13.4466, -47.479),
+    ("Eta Carinae", 10.7505, -59.684),
+    ("Gran Nube de Magallanes", 5.3920, -69.756),
+    ("Pequeña Nube de Magallanes", 0.8770, -72.830),
+]
+
+
+class Catalogo:
+    def __init__(self, nombres, ra_horas, dec_grados):
+        self.nombres = list(nombres)
+        self.ra = np.radians(np.asarray(ra_horas, dtype=np.float64) * 15.0)
+        self.dec = np.radians(np.asarray(dec_grados, dtype=np.float64))
+
+    def __len__(self):
+        return len(self.nombres)
+
+
+def cargar_catalogo(path: str = None) -> Catalogo:
+    """Catálogo base, o CSV con columnas nombre,ra_horas,dec_grados."""
+    if not path:
+        nombres, ra, dec = zip(*_CATALOGO_BASE)
+        return Catalogo(nombres, ra, dec)
+
+    nombres, ra, dec = [], [], []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            nombres.append(row["nombre"])
+            ra.append(float(row["ra_horas"]))
+            dec.append(float(row["dec_grados"]))
+    return Catalogo(nombres, ra, dec)
+
+
+def altaz(ra, dec, lat, lon, t_unix):
+    """Alt/az (grados) con broadcasting NumPy.
+
+    ra, dec: (N,) en radianes; lat, lon: (S,) en grados; t_unix: (T,).
+    Devuelve dos arreglos (S, T, N).
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))[:, None, None]
+    lon = np.asarray(lon, dtype=np.float64)[:, None, None]
+    jd = np.asarray(t_unix, dtype=np.float64) / 86400.0 + 2440587.5
+    gmst = (280.46061837 + 360.98564736629 * (jd - 2451545.0)) % 360.0
+    lst = np.radians(gmst[None, :, None] + lon)
+
+    ha = lst - ra[None, None, :]
+    sin_dec = np.sin(dec)[None, None, :]
+    cos_dec = np.cos(dec)[None, None, :]
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    cos_ha = np.cos(ha)
+
+    sin_alt = sin_dec * sin_lat + cos_dec * cos_lat * cos_ha
+    alt = np.degrees(np.arcsin(np.clip(sin_alt, -1.0, 1.0)))
+    az = np.degrees(np.arctan2(
+        -cos_dec * np.sin(ha),
+        sin_dec * cos_lat - cos_dec * sin_lat * cos_ha,
+    )) % 360.0
+    return alt, az
+
+
+def sol_radec(t_unix):
+    """RA/Dec aparentes del Sol (radianes), baja precisión (~0.01°).
+
+    Fórmula del Astronomical Almanac; t_unix: (T,).
+    """
+    n = np.asarray(t_unix, dtype=np.float64) / 86400.0 + 2440587.5 - 2451545.0
+    L = np.radians((280.460 + 0.9856474 * n) % 360.0)
+    g = np.radians((357.528 + 0.9856003 * n) % 360.0)
+    lam = L + np.radians(1.915) * np.sin(g) + np.radians(0.020) * np.sin(2 * g)
+    eps = np.radians(23.439 - 0.0000004 * n)
+    ra = np.arctan2(np.cos(eps) * np.sin(lam), np.cos(lam))
+    dec = np.arcsin(np.sin(eps) * np.sin(lam))
+    return ra, dec
+
+
+def _ventana(obs, k: int):
+    """Ventana observable que contiene el paso k, por objeto.
+
+    obs: (T, N) bool, verdadero en k para todos. Devuelve índices de la
+    última subida <= k y de la primera bajada > k (-1 si la ventana empieza
+    antes o termina después de la grilla).
+    """
+    T, N = obs.shape
+    i_sube = np.full(N, -1)
+    i_baja = np.full(N, -1)
+    if k > 0:
+        sube = obs[1:k + 1] & ~obs[:k]               # fila j -> paso j + 1
+        i_sube = np.where(sube.any(axis=0), k - sube[::-1].argmax(axis=0), -1)
+    if k < T - 1:
+        baja = obs[k:-1] & ~obs[k + 1:]              # fila j -> paso k + 1 + j
+        i_baja = np.where(baja.any(axis=0), k + 1 + baja.argmax(axis=0), -1)
+    return i_sube, i_baja
+
+
+def inicio_noche(lon: float, ahora: datetime = None) -> datetime:
+    """Mediodía solar local (UTC) que abre la noche en curso."""
+    ahora = ahora or datetime.now(timezone.utc)
+    local = ahora + timedelta(hours=lon / 15.0)
+    mediodia = local.replace(hour=12, minute=0, second=0, microsecond=0)
+    if local < mediodia:
+        mediodia -= timedelta(days=1)
+    return mediodia - timedelta(hours=lon / 15.0)
+
+
+class Visibilidad:
+    def __init__(self, catalogo: Catalogo):
+        self.catalogo = catalogo
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def precomputar(self, sitios, inicio: datetime) -> dict:
+        """sitios: lista de (lat, lon). Una sola pasada (S, T, N).
+
+        cos(HA) = cos(LST)cos(RA) + sin(LST)sin(RA), así la grilla sale de
+        productos externos sin trigonometría sobre el arreglo grande, y
+        alt > 0 equivale a sin(alt) > 0 (no hace falta arcsin).
+        """
+        t0 = inicio.timestamp()
+        tiempos = t0 + np.arange(0, HORAS_GRILLA * 60, PASO_MIN) * 60.0
+        lat = np.radians([s[0] for s in sitios])[:, None, None]
+        lon = np.asarray([s[1] for s in sitios], dtype=np.float64)[:, None]
+
+        jd = tiempos / 86400.0 + 2440587.5
+        gmst = (280.46061837 + 360.98564736629 * (jd - 2451545.0)) % 360.0
+        lst = np.radians(gmst[None, :] + lon)                      # (S, T)
+        cos_lst = np.cos(lst).astype(np.float32)[:, :, None]
+        sin_lst = np.sin(lst).astype(np.float32)[:, :, None]
+
+        # Sol sobre la misma grilla (S, T)
+        ra_sol, dec_sol = sol_radec(tiempos)
+        lat_st = lat[:, :, 0]
+        sin_alt_sol = np.sin(lat_st) * np.sin(dec_sol)[None, :] \
+            + np.cos(lat_st) * np.cos(dec_sol)[None, :] * np.cos(lst - ra_sol[None, :])
+        oscuro = sin_alt_sol < np.sin(np.radians(ALT_SOL_NOCHE))
+
+        cat = self.catalogo
+        a = (np.cos(cat.dec) * np.cos(cat.ra)).astype(np.float32)  # (N,)
+        b = (np.cos(cat.dec) * np.sin(cat.ra)).astype(np.float32)
+        c = np.sin(cat.dec).astype(np.float32)
+
+        sin_alt = (np.sin(lat) * c).astype(np.float32) \
+            + np.cos(lat).astype(np.float32) * (cos_lst * a + sin_lst * b)
+        sobre = sin_alt > 0.0
+
+        return {
+            "tiempos": tiempos,
+            "sobre": sobre,                        # (S, T, N)
+            "oscuro": oscuro,                      # (S, T)
+            "siempre_arriba": sobre.all(axis=1),
+            "sitios": list(sitios),
+        }
+
+    def noche(self, sitios, ahora: datetime = None) -> dict:
+        sitios = tuple((round(float(a), 4), round(float(b), 4)) for a, b in sitios)
+        ahora = ahora or datetime.now(timezone.utc)
+        # todos los sitios comparten la grilla del primero: mismo rango de fechas
+        inicio = inicio_noche(sitios[0][1], ahora)
+        # clave por instante UTC: sitios en distintas fechas locales conviven
+        clave = (inicio.timestamp(), sitios)
+
+        with self._lock:
+            res = self._cache.get(clave)
+            if res is None:
+                # se descartan por antigüedad las noches que ya terminaron
+                # (con una noche de margen), no por fecha
+                vencida = ahora.timestamp() - 2 * HORAS_GRILLA * 3600
+                self._cache = {k: v for k, v in self._cache.items() if k[0] >= vencida}
+                res = self.precomputar(sitios, inicio)
+                self._cache[clave] = res
+        return res
+
+    def visibles(self, lat: float, lon: float, alt_min: float = 0.0,
+                 limite: int = None, ahora: float = None, sitios=None,
+                 solo_noche: bool = True):
+        """Objetos sobre alt_min ahora (más altos primero), con la ventana
+        de salida/puesta que contiene este momento.
+
+        sitios: todos los sitios de la flota (incluye lat, lon), así una
+        sola pasada sirve para todos los telescopios. Con solo_noche, fuera
+        de la noche no hay nada visible y la ventana se corta en el
+        crepúsculo.
+        """
+        ahora = ahora or time.time()
+        sitios = list(sitios or [(lat, lon)])
+        # la noche y las alturas salen del mismo instante
+        pre = self.noche(sitios, datetime.fromtimestamp(ahora, timezone.utc))
+        s = [tuple(x) for x in pre["sitios"]].index((round(float(lat), 4), round(float(lon), 4)))
+
+        tiempos = pre["tiempos"]
+        k = min(int((ahora - tiempos[0]) // (PASO_MIN * 60)), len(tiempos) - 1)
+        obs = pre["sobre"][s]
+        if solo_noche:
+            if not pre["oscuro"][s, k]:
+                return []
+            obs = obs & pre["oscuro"][s][:, None]
+
+        alt, az = altaz(self.catalogo.ra, self.catalogo.dec, [lat], [lon], [ahora])
+        alt, az = alt[0, 0], az[0, 0]
+        # también sobre el horizonte en la grilla, para que la ventana contenga k
+        idx = np.nonzero((alt >= alt_min) & obs[k])[0]
+        idx = idx[np.argsort(-alt[idx])][:limite]
+        i_sube, i_baja = _ventana(obs[:, idx], k)
+
+        def _iso(i):
+            if i < 0:
+                return None
+            return datetime.fromtimestamp(tiempos[i], timezone.utc).isoformat()
+
+        out = []
+        for j, i in enumerate(idx):
+            out.append({
+                "objeto_celeste": self.catalogo.nombres[i],
+                "coord_altitud": round(float(alt[i]), 2),
+                "coord_azimut": round(float(az[i]), 2),
+                "circumpolar": bool(pre["siempre_arriba"][s, i]),
+                "salida": _iso(int(i_sube[j])),
+                "puesta": _iso(int(i_baja[j])),
+            })
+        return out
+
+
+if __name__ == "__main__":
+    # benchmark: python catalogo.py [n_objetos] [n_sitios]
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    s = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    rng = np.random.default_rng(0)
+    cat = Catalogo(
+        [f"obj{i}" for i in range(n)],
+        rng.uniform(0, 24, n),
+        np.degrees(np.arcsin(rng.uniform(-1, 1, n))),
+    )
+    vis = Visibilidad(cat)
+    sitios = [(-12.05 + i, -77.04 + i) for i in range(s)]
+
+    t = time.perf_counter()
+    vis.precomputar(sitios, inicio_noche(sitios[0][1]))
+    t_pre = time.perf_counter() - t
+
+    vis.noche(sitios)
+    t = time.perf_counter()
+    vis.visibles(*sitios[0], limite=50, sitios=sitios, solo_noche=False)
+    t_vis = time.perf_counter() - t
+
+    pasos = HORAS_GRILLA * 60 // PASO_MIN
+    print(f"precomputar {n} objetos x {s} sitios x {pasos} pasos: {t_pre * 1000:.1f} ms")
+    print(f"visibles (cache caliente): {t_vis * 1000:.2f} ms")
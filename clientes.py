@@ -0,0 +1,43 @@
+import os
+import threading
+
+# Registro de clientes Supabase.
+# Los clientes se construyen recién en el primer uso (no al importar app.py)
+# y se comparte un solo cliente por clave dentro de cada proceso, así todos
+# los endpoints reutilizan el mismo pool HTTP.
+
+_lock = threading.Lock()
+_clientes = {}
+_pid = os.getpid()
+
+
+def _crear(url: str, key: str):
+    # import diferido: cargar supabase es lo más caro del arranque
+    from supabase import create_client
+    return create_client(url, key)
+
+
+def obtener_cliente(url: str, key: str):
+    global _pid
+    with _lock:
+        # tras un fork (gunicorn) el hijo no debe reutilizar el pool del padre
+        if os.getpid() != _pid:
+            _clientes.clear()
+            _pid = os.getpid()
+
+        cli = _clientes.get((url, key))
+        if cli is None:
+            cli = _crear(url, key)
+            _clientes[(url, key)] = cli
+        return cli
+
+
+class ClienteLazy:
+    """Proxy que resuelve el cliente real en el primer acceso a un atributo."""
+
+    def __init__(self, url: str, key: str):
+        self._url = url
+        self._key = key
+
+    def __getattr__(self, nombre):
+        return getattr(obtener_cliente(self._url, self._key), nombre)
@@ -286,6 +286,7 @@ const objetoLabel = objeto;
       fecha_inicio: new Date().toISOString(),
       estado: "en curso",
       usuario_control: usuarioActual.id_usuario,
+      id_telescopio: telescopioActual.id_telescopio,
     });
 
     if (oErr) {
@@ -307,6 +308,8 @@ observacionActual.id_observacion =
 
     // 3) mandar orden al controlador
  try {
+  // se mide para la traza de la observación
+  const tApuntar = performance.now();
   const resp = await fetch(
     `${ESP32_CONTROLLER_BASE}/apuntar?objeto=${encodeURIComponent(objeto)}`
   );
@@ -316,6 +319,7 @@ observacionActual.id_observacion =
   }
 
   const dataCtrl = await resp.json();
+  const duracionApuntarMs = Math.round(performance.now() - tApuntar);
 
   const az = dataCtrl.azimut;
   const alt = dataCtrl.altitud;
@@ -326,6 +330,8 @@ observacionActual.id_observacion =
     id_observacion: observacionActual.id_observacion,
     coord_azimut: az,
     coord_altitud: alt,
+    id_telescopio: telescopioActual.id_telescopio,
+    duracion_apuntar_ms: duracionApuntarMs,
   });
 }
 // --- Validacion de horizonte ---
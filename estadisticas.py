@@ -0,0 +1,251 @@
+import json
+import math
+import os
+import sqlite3
+import sys
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+
+# Rollups de uso precomputados (SQLite local, compartido entre workers).
+# Cada clave guarda un acumulador compacto (o una fila por objeto en los
+# conteos); los endpoints lo actualizan al vuelo y /api/estadisticas solo
+# lee claves puntuales.
+#
+#   usuario:<id>:objetos          conteo de observaciones por objeto
+#   usuario:<id>:sesion_min       minutos de sesión del usuario
+#   telescopio:<id>:sesion_min    minutos de sesión por telescopio
+#   telescopio:<id>:espera_seg    espera en cola FIFO hasta la asignación
+#   global:objetos                conteo de observaciones por objeto
+
+PAGINA = 1000
+N_BUCKETS = 32
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup (
+    clave TEXT PRIMARY KEY,
+    tipo  TEXT NOT NULL,
+    datos BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conteo (
+    clave TEXT NOT NULL,
+    item  TEXT NOT NULL,
+    n     INTEGER NOT NULL,
+    PRIMARY KEY (clave, item)
+);
+CREATE INDEX IF NOT EXISTS ix_conteo_top ON conteo (clave, n DESC);
+"""
+
+
+def _parse_ts(valor: str) -> datetime:
+    return datetime.fromisoformat(valor.replace("Z", "+00:00"))
+
+
+class Acumulador:
+    """n, suma, min, max y un histograma log2 (para percentiles aproximados)."""
+
+    def __init__(self, datos: bytes = None):
+        if datos:
+            self.stats = array("d")
+            self.stats.frombytes(datos[:32])
+            self.buckets = array("L")
+            self.buckets.frombytes(datos[32:])
+        else:
+            self.stats = array("d", [0.0, 0.0, math.inf, -math.inf])
+            self.buckets = array("L", [0] * N_BUCKETS)
+
+    def agregar(self, valor: float):
+        valor = max(float(valor), 0.0)
+        s = self.stats
+        s[0] += 1
+        s[1] += valor
+        s[2] = min(s[2], valor)
+        s[3] = max(s[3], valor)
+        # bucket b cubre [2^(b-1), 2^b)
+        b = min(int(math.log2(valor)) + 1 if valor >= 1 else 0, N_BUCKETS - 1)
+        self.buckets[b] += 1
+
+    def percentil(self, p: float):
+        n = int(self.stats[0])
+        if not n:
+            return None
+        objetivo = math.ceil(n * p)
+        acum = 0
+        for b, c in enumerate(self.buckets):
+            acum += c
+            if acum >= objetivo:
+                return min(float(2 ** b), self.stats[3])
+        return self.stats[3]
+
+    def resumen(self) -> dict:
+        n, suma, mn, mx = self.stats
+        if not n:
+            return {"n": 0, "total": 0.0, "promedio": None, "min": None, "max": None, "p50": None, "p90": None}
+        return {
+            "n": int(n),
+            "total": round(suma, 2),
+            "promedio": round(suma / n, 2),
+            "min": round(mn, 2),
+            "max": round(mx, 2),
+            "p50": round(self.percentil(0.5), 2),
+            "p90": round(self.percentil(0.9), 2),
+        }
+
+    def a_bytes(self) -> bytes:
+        return self.stats.tobytes() + self.buckets.tobytes()
+
+
+class Estadisticas:
+    def __init__(self, path: str):
+        self.path = path
+        with self._conn() as c:
+            c.executescript(_SCHEMA)
+            # conteos guardados como JSON en rollup (versión anterior)
+            for clave, datos in c.execute(
+                    "SELECT clave, datos FROM rollup WHERE tipo = 'conteo'").fetchall():
+                c.executemany(
+                    "INSERT OR IGNORE INTO conteo (clave, item, n) VALUES (?, ?, ?)",
+                    [(clave, item, n) for item, n in json.loads(datos).items()],
+                )
+            c.execute("DELETE FROM rollup WHERE tipo = 'conteo'")
+
+    @contextmanager
+    def _conn(self):
+        c = sqlite3.connect(self.path, timeout=10)
+        try:
+            c.execute("PRAGMA journal_mode=WAL")
+            with c:
+                yield c
+        finally:
+            c.close()
+
+    # ---------- escritura ----------
+
+    def _leer(self, c, clave):
+        row = c.execute("SELECT datos FROM rollup WHERE clave = ?", (clave,)).fetchone()
+        return row[0] if row else None
+
+    def _guardar(self, c, clave, tipo, datos):
+        c.execute(
+            "INSERT INTO rollup (clave, tipo, datos) VALUES (?, ?, ?) "
+            "ON CONFLICT(clave) DO UPDATE SET datos = excluded.datos",
+            (clave, tipo, datos),
+        )
+
+    def sumar_valor(self, clave: str, valor: float):
+        with self._conn() as c:
+            c.execute("BEGIN IMMEDIATE")
+            acc = Acumulador(self._leer(c, clave))
+            acc.agregar(valor)
+            self._guardar(c, clave, "acumulador", acc.a_bytes())
+
+    def contar(self, clave: str, item: str, n: int = 1):
+        # una fila por (clave, item): el incremento no reescribe el resto
+        with self._conn() as c:
+            c.execute(
+                "INSERT INTO conteo (clave, item, n) VALUES (?, ?, ?) "
+                "ON CONFLICT(clave, item) DO UPDATE SET n = n + excluded.n",
+                (clave, item, n),
+            )
+
+    # ---------- eventos ----------
+
+    def registrar_observacion(self, id_usuario, objeto: str):
+        objeto = " ".join((objeto or "").split()) or "astro"
+        self.contar(f"usuario:{id_usuario}:objetos", objeto)
+        self.contar("global:objetos", objeto)
+
+    def registrar_sesion(self, id_telescopio, id_usuario, inicio: str, fin: str):
+        minutos = (_parse_ts(fin) - _parse_ts(inicio)).total_seconds() / 60.0
+        self.sumar_valor(f"telescopio:{id_telescopio}:sesion_min", minutos)
+        self.sumar_valor(f"usuario:{id_usuario}:sesion_min", minutos)
+
+    def registrar_espera(self, id_telescopio, ingreso: str, asignado: str):
+        seg = (_parse_ts(asignado) - _parse_ts(ingreso)).total_seconds()
+        self.sumar_valor(f"telescopio:{id_telescopio}:espera_seg", seg)
+
+    # ---------- lectura ----------
+
+    def leer(self, clave: str, top: int = 20):
+        with self._conn() as c:
+            row = c.execute(
+                "SELECT datos FROM rollup WHERE clave = ? AND tipo = 'acumulador'", (clave,)
+            ).fetchone()
+            if row:
+                return Acumulador(row[0]).resumen()
+            # top-N directo del índice (clave, n)
+            filas = c.execute(
+                "SELECT item, n FROM conteo WHERE clave = ? ORDER BY n DESC LIMIT ?",
+                (clave, top),
+            ).fetchall()
+        return dict(filas) if filas else None
+
+    # ---------- backfill ----------
+
+    def reemplazar(self, acumuladores: dict, conteos: dict):
+        """Reemplaza de una vez las claves recalculadas por el backfill."""
+        with self._conn() as c:
+            c.execute("BEGIN IMMEDIATE")
+            for clave, acc in acumuladores.items():
+                self._guardar(c, clave, "acumulador", acc.a_bytes())
+            for clave, conteo in conteos.items():
+                c.execute("DELETE FROM conteo WHERE clave = ?", (clave,))
+                c.executemany(
+                    "INSERT INTO conteo (clave, item, n) VALUES (?, ?, ?)",
+                    [(clave, item, n) for item, n in conteo.items()],
+                )
+
+
+def _paginar(cliente, tabla: str, columnas: str, filtros, orden: str):
+    desde = 0
+    while True:
+        q = cliente.table(tabla).select(columnas)
+        for col, val in filtros:
+            q = q.eq(col, val)
+        r = q.order(orden).range(desde, desde + PAGINA - 1).execute()
+        filas = r.data or []
+        yield from filas
+        if len(filas) < PAGINA:
+            return
+        desde += PAGINA
+
+
+def backfill(cliente, est: Estadisticas):
+    """Recalcula los rollups desde el histórico, página a página.
+
+    Las esperas en cola no se pueden reconstruir: la fila de queue se borra
+    al asignar, así que solo se acumulan desde que corre el endpoint.
+    """
+    acumuladores = {}
+    conteos = {}
+
+    for row in _paginar(cliente, "observacion", "usuario_control,objeto_celeste",
+                        [("estado", "finalizada")], "id_observacion"):
+        objeto = " ".join((row.get("objeto_celeste") or "").split()) or "astro"
+        for clave in (f"usuario:{row.get('usuario_control')}:objetos", "global:objetos"):
+            conteo = conteos.setdefault(clave, {})
+            conteo[objeto] = conteo.get(objeto, 0) + 1
+
+    for row in _paginar(cliente, "telescopio_sesion", "id_telescopio,id_usuario,inicio_sesion,fin_sesion",
+                        [("estado", "finalizada")], "id_sesion"):
+        if not row.get("inicio_sesion") or not row.get("fin_sesion"):
+            continue
+        minutos = (_parse_ts(row["fin_sesion"]) - _parse_ts(row["inicio_sesion"])).total_seconds() / 60.0
+        for clave in (f"telescopio:{row['id_telescopio']}:sesion_min",
+                      f"usuario:{row['id_usuario']}:sesion_min"):
+            acumuladores.setdefault(clave, Acumulador()).agregar(minutos)
+
+    est.reemplazar(acumuladores, conteos)
+    return len(acumuladores) + len(conteos)
+
+
+if __name__ == "__main__":
+    # python estadisticas.py  -> backfill desde Supabase
+    from dotenv import load_dotenv
+    from clientes import obtener_cliente
+
+    load_dotenv()
+    cliente = obtener_cliente(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY"))
+    est = Estadisticas(os.getenv("ESTADISTICAS_PATH", "estadisticas.db"))
+    n = backfill(cliente, est)
+    print(f"backfill OK: {n} claves", file=sys.stderr)
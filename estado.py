@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Estado compartido entre workers: caché con TTL, locks por nombre y
+# publicación/suscripción.
+# - EstadoLocal: en memoria del proceso (un solo worker / desarrollo).
+# - EstadoRedis: Redis o compatible (ESTADO_URL=redis://...), para gunicorn
+#   con varios workers.
+
+
+class LockOcupado(RuntimeError):
+    pass
+
+
+class EstadoLocal:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datos = {}       # clave -> (valor, expira_en | None)
+        self._locks = {}
+        self._subs = {}        # canal -> [callback]
+
+    # ---------- caché ----------
+
+    def get(self, clave: str):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            valor, expira = item
+            if expira is not None and expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            return valor
+
+    def set(self, clave: str, valor, ttl: float = None):
+        expira = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._datos[clave] = (valor, expira)
+
+    def delete(self, clave: str):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    # ---------- locks ----------
+
+    @contextmanager
+    def lock(self, nombre: str, ttl: float = 30, espera: float = 10):
+        with self._lock:
+            lk = self._locks.setdefault(nombre, threading.Lock())
+        if not lk.acquire(timeout=espera):
+            raise LockOcupado(f"Lock ocupado: {nombre}")
+        try:
+            yield
+        finally:
+            lk.release()
+
+    # ---------- pub/sub ----------
+
+    def publish(self, canal: str, mensaje: dict):
+        with self._lock:
+            subs = list(self._subs.get(canal, []))
+        for cb in subs:
+            cb(mensaje)
+
+    def subscribe(self, canal: str, callback):
+        with self._lock:
+            self._subs.setdefault(canal, []).append(callback)
+
+
+class EstadoRedis:
+    def __init__(self, url: str, prefijo: str = "papudomo:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("ESTADO_URL requiere el paquete 'redis' (pip install redis)")
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefijo = prefijo
+        self._lock = threading.Lock()
+        self._subs = {}
+        self._pubsub = None
+        self._hilo = None
+        self._pid = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._tras_fork)
+
+    def _tras_fork(self):
+        self._lock = threading.Lock()
+        if self._subs:
+            self._asegurar_hilo()
+
+    def _k(self, clave: str) -> str:
+        return self._prefijo + clave
+
+    # ---------- caché ----------
+
+    def get(self, clave: str):
+        raw = self._redis.get(self._k(clave))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, clave: str, valor, ttl: float = None):
+        px = int(ttl * 1000) if ttl else None
+        self._redis.set(self._k(clave), json.dumps(valor), px=px)
+
+    def delete(self, clave: str):
+        self._redis.delete(self._k(clave))
+
+    # ---------- locks ----------
+
+    @contextmanager
+    def lock(self, nombre: str, ttl: float = 30, espera: float = 10):
+        # ttl: si el worker muere con el lock tomado, se libera solo
+        lk = self._redis.lock(self._k("lock:" + nombre), timeout=ttl, blocking_timeout=espera)
+        if not lk.acquire():
+            raise LockOcupado(f"Lock ocupado: {nombre}")
+        try:
+            yield
+        finally:
+            try:
+                lk.release()
+            except Exception:
+                pass  # expiró por ttl
+
+    # ---------- pub/sub ----------
+
+    def publish(self, canal: str, mensaje: dict):
+        self._redis.publish(self._k("canal:" + canal), json.dumps(mensaje))
+
+    def subscribe(self, canal: str, callback):
+        with self._lock:
+            self._subs.setdefault(canal, []).append(callback)
+            self._asegurar_hilo()
+            self._pubsub.subscribe(self._k("canal:" + canal))
+
+    def _asegurar_hilo(self):
+        # el hilo y la conexión de pubsub no sobreviven a un fork
+        if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+            return
+        self._pid = os.getpid()
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        for canal in self._subs:
+            self._pubsub.subscribe(self._k("canal:" + canal))
+        self._hilo = threading.Thread(target=self._escuchar, args=(self._pubsub,),
+                                      name="estado-pubsub", daemon=True)
+        self._hilo.start()
+
+    def _escuchar(self, pubsub):
+        while True:
+            try:
+                msg = pubsub.get_message(timeout=1.0)
+            except Exception as e:
+                print("pubsub:", e)
+                time.sleep(1)
+                continue
+            if not msg:
+                continue
+
+            canal = msg["channel"].decode()[len(self._k("canal:")):]
+            with self._lock:
+                subs = list(self._subs.get(canal, []))
+            for cb in subs:
+                try:
+                    cb(json.loads(msg["data"]))
+                except Exception as e:
+                    print(f"subscriber {canal}:", e)
+
+
+def crear_estado(url: str = None):
+    url = url or os.getenv("ESTADO_URL")
+    if url:
+        return EstadoRedis(url)
+    return EstadoLocal()
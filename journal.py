@@ -0,0 +1,384 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos
+    fcntl = None
+
+# Journal local de escrituras (write-ahead).
+# Los endpoints registran la escritura en SQLite y responden al toque;
+# un hilo la reenvía a Supabase en orden, por lotes y con clave de
+# idempotencia. Si Supabase está caído las entradas esperan en disco
+# (sin límite de reintentos); solo se aparta una entrada que Supabase
+# rechaza por inválida, ver es_permanente().
+# Además de upsert/update, "subir" sube a Storage un archivo guardado en
+# disco (las fotos), así nada espera a Supabase para no perder la captura.
+
+ESPERA_MAX_SEG = 60
+RETENCION_SEG = 24 * 3600
+
+# Códigos que no se arreglan reintentando: PGRST1xx/2xx request inválido
+# (PostgREST) y las clases SQLSTATE 22 dato inválido, 23 restricción,
+# 42 columna/tabla (Postgres)
+_PGRST_PERMANENTES = ("PGRST1", "PGRST2")
+_SQLSTATE_PERMANENTES = ("22", "23", "42")
+
+
+def _status_permanente(status: int) -> bool:
+    return 400 <= status < 500 and status not in (401, 403, 408, 429)
+
+
+def es_permanente(e: Exception) -> bool:
+    """True si el error es del request en sí (reintentar da lo mismo).
+    Red, timeouts, 5xx, 429 y errores de credenciales se reintentan."""
+    status = getattr(getattr(e, "response", None), "status_code", None) \
+        or getattr(e, "status_code", None) or getattr(e, "status", None)
+    if isinstance(status, int):
+        return _status_permanente(status)
+
+    code = getattr(e, "code", None)
+    # con un cuerpo no JSON (gateway, proxy) postgrest pone el status HTTP en code
+    if isinstance(code, int):
+        return _status_permanente(code)
+    code = str(code or "")
+    if len(code) == 3 and code.isdigit():
+        return _status_permanente(int(code))
+    if code.startswith(_PGRST_PERMANENTES):
+        return True
+    return len(code) == 5 and code.startswith(_SQLSTATE_PERMANENTES)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    clave       TEXT NOT NULL UNIQUE,
+    tabla       TEXT NOT NULL,
+    op          TEXT NOT NULL,
+    datos       TEXT NOT NULL,
+    filtro      TEXT,
+    conflicto   TEXT,
+    creado_el   REAL NOT NULL,
+    intentos    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    aplicado_el REAL,
+    descartado  INTEGER NOT NULL DEFAULT 0,
+    ref         TEXT,
+    evento      TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_journal_pendiente
+    ON journal (aplicado_el, descartado, seq);
+CREATE INDEX IF NOT EXISTS ix_journal_ref ON journal (ref);
+"""
+
+
+class Journal:
+    def __init__(self, path: str, cliente, lote: int = 50, intervalo: float = 2.0,
+                 trazas=None):
+        self.path = path
+        self.cliente = cliente
+        self.trazas = trazas    # span por ref (id_observacion) en cada envío a Supabase
+        self.lote = lote
+        self.intervalo = intervalo
+        self._evento = threading.Event()
+        self._hilo = None
+        self._pid = None
+        self._lock_hilo = threading.Lock()
+        self._lock_replay = threading.Lock()
+        self.ultimo_error = None
+        self.aplicados = 0
+        self._proximo_intento = 0.0   # monotonic; durante el backoff no se reintenta antes
+        self._eventos = {}
+
+        with self._conn() as c:
+            # journal.db creados antes de estas columnas
+            for col in ("ref", "evento"):
+                try:
+                    c.execute(f"ALTER TABLE journal ADD COLUMN {col} TEXT")
+                except sqlite3.OperationalError:
+                    pass
+            c.executescript(_SCHEMA)
+
+    @contextmanager
+    def _conn(self):
+        c = sqlite3.connect(self.path, timeout=10)
+        try:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=FULL")
+            with c:
+                yield c
+        finally:
+            c.close()
+
+    # ---------- escritura ----------
+
+    def registrar(self, tabla: str, op: str, datos: dict, filtro=None,
+                  conflicto: str = None, clave: str = None, ref: str = None,
+                  evento: str = None) -> str:
+        """Guarda la escritura en disco y devuelve su clave de idempotencia.
+
+        op: "upsert" (requiere conflicto), "update" (requiere filtro,
+        lista de pares [columna, valor] comparados por igualdad) o "subir"
+        (tabla es el bucket; datos: archivo local, path y content_type;
+        el archivo se borra una vez subido).
+        ref: id de la fila afectada (p.ej. id_observacion), ver vista_pendiente().
+        evento: nombre del hook de al_aplicar() que recibe las filas que
+        Supabase devuelve; con un filtro condicional (p.ej. estado = "en
+        curso") solo llegan las filas que esta escritura cambió de verdad.
+        """
+        if op not in ("upsert", "update", "subir"):
+            raise ValueError(f"op inválida: {op}")
+        if op == "update" and not filtro:
+            raise ValueError("update sin filtro")
+
+        clave = clave or str(uuid.uuid4())
+        with self._conn() as c:
+            # la misma clave dos veces no duplica la escritura
+            c.execute(
+                "INSERT OR IGNORE INTO journal "
+                "(clave, tabla, op, datos, filtro, conflicto, creado_el, ref, evento) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (clave, tabla, op, json.dumps(datos),
+                 json.dumps(filtro) if filtro else None, conflicto, time.time(),
+                 str(ref) if ref is not None else None, evento),
+            )
+        self._asegurar_hilo()
+        self._evento.set()
+        return clave
+
+    def al_aplicar(self, evento: str, fn):
+        """fn(fila) por cada fila que devuelva una escritura con ese evento."""
+        self._eventos.setdefault(evento, []).append(fn)
+
+    # ---------- replay ----------
+
+    def _pendientes(self, c):
+        return c.execute(
+            "SELECT seq, clave, tabla, op, datos, filtro, conflicto, ref, evento "
+            "FROM journal WHERE aplicado_el IS NULL AND descartado = 0 "
+            "ORDER BY seq LIMIT ?",
+            (self.lote,),
+        ).fetchall()
+
+    def _agrupar(self, filas):
+        # upserts consecutivos a la misma tabla/conflicto van en un solo request
+        # (PostgREST exige que todas las filas del lote tengan las mismas columnas)
+        grupos = []
+        firma_previa = None
+        for f in filas:
+            firma = (f[2], f[6], tuple(sorted(json.loads(f[4])))) if f[3] == "upsert" else None
+            if firma is not None and firma == firma_previa:
+                grupos[-1].append(f)
+            else:
+                grupos.append([f])
+            firma_previa = firma
+        return grupos
+
+    def _aplicar(self, grupo):
+        _, _, tabla, op, _, filtro, conflicto, _, _ = grupo[0]
+        if op == "subir":
+            datos = json.loads(grupo[0][4])
+            with open(datos["archivo"], "rb") as f:
+                contenido = f.read()
+            self.cliente.storage.from_(tabla).upload(
+                path=datos["path"],
+                file=contenido,
+                file_options={"content-type": datos.get("content_type", "application/octet-stream"),
+                              "upsert": "true"},
+            )
+            return None
+
+        if op == "upsert":
+            filas = [json.loads(f[4]) for f in grupo]
+            self.cliente.table(tabla).upsert(filas, on_conflict=conflicto).execute()
+            return None
+
+        q = self.cliente.table(tabla).update(json.loads(grupo[0][4]))
+        for col, val in json.loads(filtro):
+            q = q.eq(col, val)
+        return q.execute()
+
+    def _notificar(self, evento, r):
+        for fila in (getattr(r, "data", None) or []):
+            for fn in self._eventos.get(evento, []):
+                try:
+                    fn(fila)
+                except Exception as e:
+                    # la escritura ya está en Supabase: no se reintenta por esto
+                    print(f"journal: hook {evento}:", e)
+
+    def _marcar_aplicado(self, c, seqs):
+        marcas = ",".join("?" * len(seqs))
+        c.execute(
+            f"UPDATE journal SET aplicado_el = ?, error = NULL WHERE seq IN ({marcas})",
+            [time.time()] + seqs,
+        )
+        c.commit()
+        self.aplicados += len(seqs)
+
+    def _trazar(self, grupo, inicio: float, duracion_ms: float, error: str = None):
+        if self.trazas is None:
+            return
+        # el request es uno solo: cada observación del lote ve su duración completa
+        for ref in dict.fromkeys(f[7] for f in grupo if f[7]):
+            self.trazas.registrar(ref, f"supabase_{grupo[0][3]}", inicio, duracion_ms,
+                                  origen="journal", error=error)
+
+    def _intentar(self, c, grupo) -> bool:
+        """Aplica un grupo. False si hay que cortar el replay (error transitorio)."""
+        seqs = [f[0] for f in grupo]
+        inicio = time.time()
+        t = time.perf_counter()
+        try:
+            r = self._aplicar(grupo)
+        except Exception as e:
+            self._trazar(grupo, inicio, (time.perf_counter() - t) * 1000, str(e))
+            # sin el archivo local no hay nada que reintentar
+            permanente = isinstance(e, FileNotFoundError) or es_permanente(e)
+            if permanente and len(grupo) > 1:
+                # lote rechazado: fila por fila, para apartar solo la inválida
+                for f in grupo:
+                    if not self._intentar(c, [f]):
+                        return False
+                return True
+
+            self.ultimo_error = str(e)
+            marcas = ",".join("?" * len(seqs))
+            c.execute(
+                f"UPDATE journal SET intentos = intentos + 1, error = ?, descartado = ? "
+                f"WHERE seq IN ({marcas})",
+                [str(e), 1 if permanente else 0] + seqs,
+            )
+            c.commit()
+            if permanente:
+                # queda en disco con su error para revisarla a mano
+                print(f"journal: entrada {grupo[0][1]} descartada: {e}")
+                return True
+            return False
+
+        self._trazar(grupo, inicio, (time.perf_counter() - t) * 1000)
+        self._marcar_aplicado(c, seqs)
+        if grupo[0][3] == "subir":
+            try:
+                os.remove(json.loads(grupo[0][4])["archivo"])
+            except OSError:
+                pass
+        if grupo[0][8]:
+            self._notificar(grupo[0][8], r)
+        return True
+
+    def replay(self) -> int:
+        """Reenvía pendientes en orden hasta vaciar o fallar. Devuelve cuántos aplicó."""
+        if not self._lock_replay.acquire(blocking=False):
+            return 0
+        lockf = None
+        try:
+            # un solo proceso reenvía a la vez (varios workers, mismo archivo)
+            if fcntl is not None:
+                lockf = open(self.path + ".lock", "w")
+                try:
+                    fcntl.flock(lockf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return 0
+
+            antes = self.aplicados
+            with self._conn() as c:
+                while True:
+                    filas = self._pendientes(c)
+                    if not filas:
+                        break
+                    for grupo in self._agrupar(filas):
+                        if not self._intentar(c, grupo):
+                            return self.aplicados - antes
+
+                c.execute(
+                    "DELETE FROM journal WHERE aplicado_el IS NOT NULL AND aplicado_el < ?",
+                    (time.time() - RETENCION_SEG,),
+                )
+            self.ultimo_error = None
+            return self.aplicados - antes
+        finally:
+            if lockf is not None:
+                lockf.close()
+            self._lock_replay.release()
+
+    def pendientes(self, tabla: str, op: str = None) -> list:
+        """Datos de las escrituras aún no aplicadas (más antiguas primero)."""
+        with self._conn() as c:
+            filas = c.execute(
+                "SELECT op, datos FROM journal "
+                "WHERE tabla = ? AND aplicado_el IS NULL AND descartado = 0 ORDER BY seq",
+                (tabla,),
+            ).fetchall()
+        return [json.loads(datos) for o, datos in filas if op is None or o == op]
+
+    def vista_pendiente(self, tabla: str) -> dict:
+        """ref -> columnas que el journal todavía tiene que escribir en esa
+        fila (upserts y updates aún no aplicados, combinados en orden)."""
+        with self._conn() as c:
+            filas = c.execute(
+                "SELECT ref, datos FROM journal "
+                "WHERE tabla = ? AND ref IS NOT NULL AND aplicado_el IS NULL AND descartado = 0 "
+                "ORDER BY seq",
+                (tabla,),
+            ).fetchall()
+        vista = {}
+        for ref, datos in filas:
+            vista.setdefault(ref, {}).update(json.loads(datos))
+        return vista
+
+    def _bucle(self):
+        espera = self.intervalo
+        while True:
+            self._evento.wait(espera)
+            self._evento.clear()
+            # un aviso de registrar() no adelanta el reintento:
+            # si está en backoff se completa la espera
+            resto = self._proximo_intento - time.monotonic()
+            if resto > 0:
+                time.sleep(resto)
+                self._evento.clear()
+            try:
+                self.replay()
+            except Exception as e:
+                self.ultimo_error = str(e)
+            # backoff mientras Supabase siga fallando
+            if self.ultimo_error:
+                espera = min(espera * 2, ESPERA_MAX_SEG)
+                self._proximo_intento = time.monotonic() + espera
+            else:
+                espera = self.intervalo
+                self._proximo_intento = 0.0
+
+    def _asegurar_hilo(self):
+        # el hilo no sobrevive a un fork, se relanza en cada proceso
+        with self._lock_hilo:
+            if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+                return
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._bucle, name="journal-replay", daemon=True)
+            self._hilo.start()
+
+    # ---------- métricas ----------
+
+    def metricas(self) -> dict:
+        with self._conn() as c:
+            pendientes, mas_antiguo = c.execute(
+                "SELECT COUNT(*), MIN(creado_el) FROM journal "
+                "WHERE aplicado_el IS NULL AND descartado = 0"
+            ).fetchone()
+            descartados = c.execute(
+                "SELECT COUNT(*) FROM journal WHERE descartado = 1"
+            ).fetchone()[0]
+
+        return {
+            "pendientes": pendientes,
+            "descartados": descartados,
+            "lag_segundos": round(time.time() - mas_antiguo, 3) if mas_antiguo else 0.0,
+            "aplicados": self.aplicados,
+            "ultimo_error": self.ultimo_error,
+        }
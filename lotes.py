@@ -0,0 +1,239 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+# Lotes de observación desatendidos.
+# Recibe una lista de objetivos por telescopio y, por cada uno, hace lo mismo
+# que domo_control.js: abre la observación, apunta con el ESP32 base, espera
+# a que el domo se estabilice, dispara la cámara, baja la foto y finaliza.
+# Cada telescopio tiene su propio pool acotado de hilos, así la flota trabaja
+# en paralelo pero un mismo montaje nunca recibe dos órdenes a la vez.
+# Antes de cada objetivo se vuelve a comprobar la sesión: si el usuario la
+# cerró o expiró, se cancela lo que queda en ese telescopio.
+
+TTL_PROGRESO = 24 * 3600
+
+
+def _now_utc_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Planificador:
+    def __init__(self, journal, estado, obtener_url, descargar_foto,
+                 hilos_por_dispositivo: int = 1, estabilizar_seg: float = 8.0,
+                 trazas=None, sesion_vigente=None):
+        self.journal = journal
+        self.estado = estado
+        self.obtener_url = obtener_url      # (tipo, id_telescopio) -> "http://host:puerto"
+        self.descargar_foto = descargar_foto  # (id_observacion, id_telescopio, objeto) -> foto_path
+        self.hilos = hilos_por_dispositivo
+        self.estabilizar_seg = estabilizar_seg
+        self.trazas = trazas
+        self.sesion_vigente = sesion_vigente  # (id_sesion, id_usuario) -> bool
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._lotes = {}
+
+    def _pool(self, id_telescopio: int) -> ThreadPoolExecutor:
+        with self._lock:
+            pool = self._pools.get(id_telescopio)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=self.hilos,
+                                          thread_name_prefix=f"lote-tel{id_telescopio}")
+                self._pools[id_telescopio] = pool
+            return pool
+
+    # ---------- progreso ----------
+
+    def _publicar(self, id_lote: str):
+        with self._lock:
+            lote = self._lotes[id_lote]
+            pendientes = sum(1 for o in lote["objetivos"] if o["estado"] in ("pendiente", "en curso"))
+            lote["estado"] = "en curso" if pendientes else "finalizado"
+            if not pendientes and not lote.get("fin"):
+                lote["fin"] = _now_utc_iso()
+            copia = {**lote, "objetivos": [dict(o) for o in lote["objetivos"]]}
+            if not pendientes:
+                # terminado: el progreso queda en el estado compartido (TTL_PROGRESO)
+                del self._lotes[id_lote]
+        # en el estado compartido para que cualquier worker pueda consultarlo
+        self.estado.set(f"lote:{id_lote}", copia, ttl=TTL_PROGRESO)
+
+    def progreso(self, id_lote: str):
+        return self.estado.get(f"lote:{id_lote}")
+
+    # ---------- ejecución ----------
+
+    def crear_lote(self, id_usuario, objetivos_por_telescopio: dict, sesiones: dict) -> str:
+        """objetivos_por_telescopio: {id_telescopio: [objeto, ...]};
+        sesiones: {id_telescopio: id_sesion} activas del usuario."""
+        id_lote = str(uuid.uuid4())
+        objetivos = []
+        for id_telescopio, lista in objetivos_por_telescopio.items():
+            for objeto in lista:
+                objetivos.append({
+                    "id_telescopio": id_telescopio,
+                    "objeto_celeste": objeto,
+                    "estado": "pendiente",
+                    "id_observacion": None,
+                    "error": None,
+                    "tiempos": {},
+                })
+
+        with self._lock:
+            self._lotes[id_lote] = {
+                "id_lote": id_lote,
+                "id_usuario": id_usuario,
+                "inicio": _now_utc_iso(),
+                "fin": None,
+                "estado": "en curso",
+                "objetivos": objetivos,
+                "cancelados": [],       # telescopios cuya sesión ya no está activa
+            }
+        self._publicar(id_lote)
+
+        for i, obj in enumerate(objetivos):
+            tel = obj["id_telescopio"]
+            self._pool(tel).submit(self._ejecutar, id_lote, i, id_usuario, sesiones[tel])
+        return id_lote
+
+    def _cancelado(self, id_lote: str, id_telescopio) -> bool:
+        with self._lock:
+            return id_telescopio in self._lotes[id_lote]["cancelados"]
+
+    def _ejecutar(self, id_lote: str, i: int, id_usuario, id_sesion):
+        with self._lock:
+            obj = self._lotes[id_lote]["objetivos"][i]
+            obj["estado"] = "en curso"
+        self._publicar(id_lote)
+        tel = obj["id_telescopio"]
+
+        tiempos = {}
+        t_total = time.perf_counter()
+        try:
+            if self._cancelado(id_lote, tel):
+                estado, error = "cancelado", "La sesión del telescopio ya no está activa"
+            else:
+                # también entre workers: un montaje, una orden a la vez
+                with self.estado.lock(f"dispositivo:{tel}", ttl=300, espera=600):
+                    if self.sesion_vigente is not None and not self.sesion_vigente(id_sesion, id_usuario):
+                        with self._lock:
+                            self._lotes[id_lote]["cancelados"].append(tel)
+                        estado, error = "cancelado", "La sesión del telescopio ya no está activa"
+                    else:
+                        estado, error = self._observar(obj, id_usuario, id_sesion, tiempos)
+        except Exception as e:
+            estado, error = "error", str(e)
+            # no dejar la observación colgada "en curso"
+            if obj["id_observacion"]:
+                self.journal.registrar("observacion", "update", {
+                    "estado": "finalizada", "fecha_fin": _now_utc_iso(),
+                    "descripcion": f"Lote: {error}",
+                }, filtro=[["id_observacion", obj["id_observacion"]], ["estado", "en curso"]],
+                    clave=f"obs-finalizar-{obj['id_observacion']}", ref=obj["id_observacion"],
+                    evento="obs_finalizada")
+        tiempos["total"] = round(time.perf_counter() - t_total, 3)
+
+        with self._lock:
+            obj["estado"] = estado
+            obj["error"] = error
+            obj["tiempos"] = tiempos
+        self._publicar(id_lote)
+
+    def _medir(self, obj: dict, tiempos: dict, etapa: str, fn, *args):
+        inicio = time.time()
+        t = time.perf_counter()
+        error = None
+        try:
+            return fn(*args)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            dur = time.perf_counter() - t
+            tiempos[etapa] = round(dur, 3)
+            if self.trazas is not None:
+                self.trazas.registrar(obj["id_observacion"], etapa, inicio, dur * 1000,
+                                      id_telescopio=obj["id_telescopio"], origen="lote", error=error)
+
+    def _observar(self, obj: dict, id_usuario, id_sesion, tiempos: dict):
+        id_telescopio = obj["id_telescopio"]
+        objeto = obj["objeto_celeste"]
+        id_observacion = str(uuid.uuid4())
+        obj["id_observacion"] = id_observacion
+        filtro = [["id_observacion", id_observacion]]
+        # cerrar solo si sigue en curso; el rollup cuenta por el evento
+        filtro_fin = filtro + [["estado", "en curso"]]
+
+        # 1) abrir observación
+        self.journal.registrar("observacion", "upsert", {
+            "id_observacion": id_observacion,
+            "id_sesion": str(id_sesion),
+            "objeto_celeste": objeto,
+            "fecha_inicio": _now_utc_iso(),
+            "estado": "en curso",
+            "usuario_control": id_usuario,
+        }, conflicto="id_observacion", clave=f"obs-insert-{id_observacion}", ref=id_observacion)
+        self.estado.publish("observaciones", {
+            "id_usuario": id_usuario,
+            "id_observacion": id_observacion,
+            "objeto_celeste": objeto,
+            "fecha_inicio": _now_utc_iso(),
+        })
+
+        # 2) apuntar
+        base = self.obtener_url("esp32_base", id_telescopio)
+        r = self._medir(obj, tiempos, "apuntar", lambda: requests.get(
+            f"{base}/apuntar", params={"objeto": objeto}, timeout=30))
+        r.raise_for_status()
+        ctrl = r.json()
+        az, alt = ctrl.get("azimut"), ctrl.get("altitud")
+        if az is not None and alt is not None:
+            self.journal.registrar("observacion", "update",
+                                   {"coord_azimut": az, "coord_altitud": alt}, filtro=filtro,
+                                   ref=id_observacion)
+
+        # mismo criterio que la UI: sin altitud o bajo el horizonte no se toma
+        # foto; si el controlador no mueve el domo solo se avisa y se sigue
+        motivo = None
+        if alt is None:
+            motivo = "No se obtuvo la altitud del objeto"
+        elif float(alt) < 0:
+            motivo = f"Objeto bajo el horizonte (altitud {float(alt):.1f}°)"
+        avisos = []
+        if ctrl.get("mueve") is False:
+            avisos.append(ctrl.get("razon") or "El controlador no movió el domo")
+
+        if motivo:
+            self.journal.registrar("observacion", "update", {
+                "estado": "finalizada", "fecha_fin": _now_utc_iso(), "descripcion": motivo,
+            }, filtro=filtro_fin, clave=f"obs-finalizar-{id_observacion}", ref=id_observacion,
+                evento="obs_finalizada")
+            return "omitido", motivo
+
+        # 3) estabilizar y disparar
+        self._medir(obj, tiempos, "estabilizar", time.sleep, self.estabilizar_seg)
+        cam = self.obtener_url("esp32_cam", id_telescopio)
+        r = self._medir(obj, tiempos, "disparar", lambda: requests.get(f"{cam}/disparar", timeout=30))
+        r.raise_for_status()
+
+        # 4) finalizar y bajar la foto antes del próximo disparo; la subida a
+        # Storage la hace el journal cuando la fila ya está en Supabase
+        self.journal.registrar("observacion", "update", {
+            "estado": "finalizada", "fecha_fin": _now_utc_iso(),
+        }, filtro=filtro_fin, clave=f"obs-finalizar-{id_observacion}", ref=id_observacion,
+            evento="obs_finalizada")
+        try:
+            self._medir(obj, tiempos, "foto", self.descargar_foto, id_observacion, id_telescopio, objeto)
+        except Exception as e:
+            avisos.append(f"No se pudo obtener la foto: {str(e)}")
+
+        warning = "; ".join(avisos) or None
+        if warning:
+            self.journal.registrar("observacion", "update", {"descripcion": warning},
+                                  filtro=filtro, ref=id_observacion)
+        return "finalizado", warning
@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+# Las pruebas importan app.py: credenciales ficticias (los clientes Supabase
+# son lazy y nunca llegan a conectarse) y archivos SQLite en un directorio
+# temporal en vez del cwd.
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+_TMP = tempfile.mkdtemp(prefix="papudomo-tests-")
+
+ENV_PRUEBAS = {
+    "SUPABASE_URL": "https://dummy.supabase.co",
+    "SUPABASE_ANON_KEY": "anon-dummy",
+    "SUPABASE_SERVICE_ROLE_KEY": "service-dummy",
+    "JOURNAL_PATH": os.path.join(_TMP, "journal.db"),
+    "ESTADISTICAS_PATH": os.path.join(_TMP, "estadisticas.db"),
+    "TRAZAS_PATH": os.path.join(_TMP, "trazas.db"),
+}
+os.environ.update(ENV_PRUEBAS)
+os.environ.pop("ESTADO_URL", None)
@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import ENV_PRUEBAS, RAIZ
+
+# Presupuesto de arranque: `import app` no debe construir clientes ni
+# cargar supabase/numpy (hoy ~0.3 s; el margen cubre máquinas lentas de CI).
+PRESUPUESTO_SEG = 2.0
+
+_SCRIPT = """
+import json, sys, time
+t = time.perf_counter()
+import app
+print(json.dumps({
+    "seg": time.perf_counter() - t,
+    "supabase": "supabase" in sys.modules,
+    "numpy": "numpy" in sys.modules,
+}))
+"""
+
+
+def _medir_import():
+    env = {**os.environ, **ENV_PRUEBAS}
+    env.pop("ESTADO_URL", None)
+    out = subprocess.run(
+        [sys.executable, "-c", _SCRIPT],
+        cwd=RAIZ, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_import_app_no_carga_supabase():
+    res = _medir_import()
+    assert res["supabase"] is False
+    assert res["numpy"] is False
+
+
+def test_import_app_dentro_del_presupuesto():
+    res = _medir_import()
+    assert res["seg"] < PRESUPUESTO_SEG, f"import app tardó {res['seg']:.2f} s"
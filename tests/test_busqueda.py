@@ -0,0 +1,65 @@
+from busqueda import IndiceBusqueda, IndiceUsuario
+
+
+class _Resp:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def __getattr__(self, _):
+        return lambda *a, **k: self
+
+    def execute(self):
+        self.cliente.lecturas += 1
+        if self.cliente.durante_lectura:
+            self.cliente.durante_lectura()
+        return _Resp(list(self.cliente.filas))
+
+
+class _Cliente:
+    def __init__(self, filas):
+        self.filas = filas
+        self.lecturas = 0
+        self.durante_lectura = None
+
+    def table(self, _):
+        return _Query(self)
+
+
+def _fila(id_obs, objeto, fecha="2026-10-01"):
+    return {"id_observacion": id_obs, "objeto_celeste": objeto, "fecha_inicio": fecha}
+
+
+def test_consulta_corta_es_subcadena():
+    idx = IndiceUsuario()
+    idx.agregar("1", "M42 Orión", "2026-01-01")
+    idx.agregar("2", "Omega Centauri", "2026-01-02")
+    assert idx.buscar("42") == ["1"]
+    assert idx.buscar("ga") == ["2"]
+
+
+def test_incluye_pendientes_y_lo_que_llega_durante_la_carga():
+    cli = _Cliente([_fila("1", "M42")])
+    ib = IndiceBusqueda(cli, pendientes=lambda: [
+        {**_fila("2", "Vega"), "usuario_control": "u"},
+        {**_fila("3", "Vega"), "usuario_control": "otro"},
+    ])
+    cli.durante_lectura = lambda: ib.agregar("u", "4", "Vega", "2026-10-02")
+
+    assert sorted(ib.buscar("u", "vega")) == ["2", "4"]
+    assert ib.buscar("u", "m42") == ["1"]
+
+
+def test_se_reconstruye_pasado_el_ttl():
+    cli = _Cliente([_fila("1", "M42")])
+    ib = IndiceBusqueda(cli, ttl=0.0)
+    assert ib.buscar("u", "vega") == []
+
+    # insert cuyo mensaje este worker no recibió
+    cli.filas.append(_fila("2", "Vega"))
+    assert ib.buscar("u", "vega") == ["2"]
+    assert cli.lecturas == 2
@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from catalogo import Visibilidad, cargar_catalogo
+
+LIMA = (-12.05, -77.04)
+TOKIO = (35.68, 139.69)
+
+
+def _ts(iso: str) -> float:
+    return datetime.fromisoformat(iso).timestamp()
+
+
+@pytest.fixture(scope="module")
+def vis():
+    return Visibilidad(cargar_catalogo())
+
+
+@pytest.mark.parametrize("ahora", [
+    "2026-10-19T08:00:00+00:00",    # 03:00 en Lima
+    "2026-10-20T00:30:00+00:00",    # 19:30 en Lima, recién de noche
+    "2026-03-02T06:00:00+00:00",
+])
+def test_ventana_contiene_ahora(vis, ahora):
+    t = _ts(ahora)
+    items = vis.visibles(*LIMA, ahora=t, sitios=[LIMA, TOKIO])
+    assert items
+    for it in items:
+        if it["circumpolar"]:
+            continue
+        if it["salida"] is not None:
+            assert _ts(it["salida"]) <= t, it
+        if it["puesta"] is not None:
+            assert t < _ts(it["puesta"]), it
+
+
+def test_de_dia_no_hay_nada_visible(vis):
+    t = _ts("2026-10-19T17:00:00+00:00")     # mediodía en Lima
+    assert vis.visibles(*LIMA, ahora=t) == []
+    assert vis.visibles(*LIMA, ahora=t, solo_noche=False)
+
+
+def test_flota_en_una_sola_pasada(vis):
+    t = _ts("2026-10-19T08:00:00+00:00")
+    vis.visibles(*LIMA, ahora=t, sitios=[LIMA, TOKIO])
+    n = len(vis._cache)
+    vis.visibles(*TOKIO, ahora=t, sitios=[LIMA, TOKIO], solo_noche=False)
+    assert len(vis._cache) == n
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import redis
+
+import app as app_mod
+from estado import EstadoRedis
+
+# Dos workers (dos EstadoRedis contra el mismo servidor): lo que asigna uno
+# lo tiene que ver y recibir el otro.
+
+
+class _Resp:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Tabla:
+    def __init__(self, db, nombre):
+        self.db = db
+        self.nombre = nombre
+        self.filtros = []
+        self.accion = "select"
+        self.fila = None
+
+    def select(self, *_):
+        return self
+
+    def eq(self, col, val):
+        self.filtros.append((col, val))
+        return self
+
+    def order(self, *_, **__):
+        return self
+
+    def limit(self, *_):
+        return self
+
+    def delete(self):
+        self.accion = "delete"
+        return self
+
+    def insert(self, fila):
+        self.accion = "insert"
+        self.fila = fila
+        return self
+
+    def execute(self):
+        filas = self.db.setdefault(self.nombre, [])
+        if self.accion == "insert":
+            filas.append(dict(self.fila))
+            return _Resp([dict(self.fila)])
+        hits = [f for f in filas if all(f.get(c) == v for c, v in self.filtros)]
+        if self.accion == "delete":
+            self.db[self.nombre] = [f for f in filas if f not in hits]
+        return _Resp(hits)
+
+
+class _Supabase:
+    def __init__(self):
+        self.db = {"queue": [{
+            "id_queue": 7, "id_telescopio": 1, "id_usuario": "u-1",
+            "timestamp_ingreso": "2026-01-01T00:00:00+00:00",
+        }]}
+
+    def table(self, nombre):
+        return _Tabla(self.db, nombre)
+
+
+@pytest.fixture
+def dos_workers(monkeypatch):
+    servidor = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url",
+                        staticmethod(lambda url, **kw: fakeredis.FakeRedis(server=servidor)))
+    return EstadoRedis("redis://fake"), EstadoRedis("redis://fake")
+
+
+def test_asignacion_visible_en_otro_worker(dos_workers, monkeypatch):
+    worker_a, worker_b = dos_workers
+    sb = _Supabase()
+    monkeypatch.setattr(app_mod, "estado", worker_a)
+    monkeypatch.setattr(app_mod, "sb_admin", sb)
+
+    recibido = []
+    llego = threading.Event()
+    worker_b.subscribe("cola", lambda m: (recibido.append(m), llego.set()))
+
+    with app_mod.app.test_request_context():
+        resp = app_mod._asignar_siguiente(1)
+    assert resp.get_json()["ok"] is True
+    assert sb.db["queue"] == []
+
+    asignacion = worker_b.get("cola:1:ultima_asignacion")
+    assert asignacion["id_usuario"] == "u-1"
+    assert asignacion["id_telescopio"] == 1
+
+    assert llego.wait(5), "el otro worker no recibió la asignación"
+    assert recibido == [asignacion]
+
+
+def test_lock_de_cola_compartido(dos_workers):
+    worker_a, worker_b = dos_workers
+    from estado import LockOcupado
+
+    with worker_a.lock("cola:1", espera=1):
+        with pytest.raises(LockOcupado):
+            with worker_b.lock("cola:1", espera=0.1):
+                pass
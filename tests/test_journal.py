@@ -0,0 +1,200 @@
+import time
+
+import pytest
+
+from journal import Journal, es_permanente
+
+APIError = pytest.importorskip("postgrest.exceptions").APIError
+
+# Journal contra un cliente falso: qué se reintenta, qué se descarta y qué
+# queda pendiente.
+
+
+def _error(code):
+    return APIError({"message": "x", "code": code, "hint": None, "details": None})
+
+
+@pytest.mark.parametrize("code, permanente", [
+    # status HTTP (cuerpo no JSON: postgrest lo pone en code)
+    (429, False), ("429", False), (503, False), (401, False), (408, False),
+    (400, True), (422, True), ("404", True),
+    # PostgREST
+    ("PGRST204", True), ("PGRST116", True), ("PGRST301", False),
+    # SQLSTATE
+    ("23505", True), ("22P02", True), ("42P01", True), ("40001", False), ("08006", False),
+    (None, False),
+])
+def test_es_permanente(code, permanente):
+    assert es_permanente(_error(code)) is permanente
+
+
+def test_error_de_red_no_es_permanente():
+    assert es_permanente(ConnectionError("caído")) is False
+
+
+class _Query:
+    def __init__(self, cliente, tabla):
+        self.cliente = cliente
+        self.tabla = tabla
+        self.filas = None
+
+    def upsert(self, filas, on_conflict=None):
+        self.filas = filas
+        return self
+
+    def update(self, datos):
+        self.filas = [datos]
+        return self
+
+    def eq(self, *_):
+        return self
+
+    def execute(self):
+        self.cliente.requests += 1
+        if self.cliente.falla is not None:
+            raise self.cliente.falla
+        if any(f.get("objeto_celeste") == "malo" for f in self.filas):
+            raise _error("23502")
+        self.cliente.escritas += self.filas
+
+
+class _Bucket:
+    def __init__(self, cliente, bucket):
+        self.cliente = cliente
+        self.bucket = bucket
+
+    def upload(self, path, file, file_options=None):
+        self.cliente.requests += 1
+        if self.cliente.falla is not None:
+            raise self.cliente.falla
+        self.cliente.subidas[(self.bucket, path)] = file
+
+
+class _Cliente:
+    def __init__(self):
+        self.falla = None
+        self.requests = 0
+        self.escritas = []
+        self.subidas = {}
+        self.storage = self
+
+    def table(self, tabla):
+        return _Query(self, tabla)
+
+    def from_(self, bucket):
+        return _Bucket(self, bucket)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    cli = _Cliente()
+    j = Journal(str(tmp_path / "journal.db"), cli)
+    j._asegurar_hilo = lambda: None    # replay a mano, sin hilo
+    return j, cli
+
+
+def _insert(j, id_obs, objeto="M42"):
+    j.registrar("observacion", "upsert",
+                {"id_observacion": id_obs, "objeto_celeste": objeto},
+                conflicto="id_observacion", ref=id_obs)
+
+
+def test_429_se_reintenta_sin_descartar(journal):
+    j, cli = journal
+    _insert(j, "a")
+    cli.falla = _error(429)
+    for _ in range(20):
+        assert j.replay() == 0
+
+    m = j.metricas()
+    assert m["pendientes"] == 1 and m["descartados"] == 0
+    assert "a" in j.vista_pendiente("observacion")
+
+    cli.falla = None
+    assert j.replay() == 1
+    assert cli.escritas == [{"id_observacion": "a", "objeto_celeste": "M42"}]
+    assert j.vista_pendiente("observacion") == {}
+
+
+def test_lote_rechazado_aparta_solo_la_fila_invalida(journal):
+    j, cli = journal
+    for id_obs, objeto in (("a", "M42"), ("b", "malo"), ("c", "Vega")):
+        _insert(j, id_obs, objeto)
+
+    assert j.replay() == 2
+    assert [f["id_observacion"] for f in cli.escritas] == ["a", "c"]
+    m = j.metricas()
+    assert m["pendientes"] == 0 and m["descartados"] == 1
+
+
+def test_error_transitorio_corta_el_replay_en_orden(journal):
+    j, cli = journal
+    _insert(j, "a")
+    j.registrar("observacion", "update", {"estado": "finalizada"},
+                filtro=[["id_observacion", "a"]], ref="a")
+    cli.falla = ConnectionError("caído")
+    j.replay()
+    # no sigue con el update si el insert no llegó
+    assert cli.requests == 1
+    assert j.metricas()["pendientes"] == 2
+
+
+def test_escrituras_no_adelantan_el_backoff(tmp_path):
+    cli = _Cliente()
+    cli.falla = ConnectionError("caído")
+    j = Journal(str(tmp_path / "journal.db"), cli, intervalo=0.05)
+
+    t = time.monotonic()
+    i = 0
+    while time.monotonic() - t < 0.5:
+        _insert(j, f"obs-{i}")
+        i += 1
+        time.sleep(0.01)
+
+    # backoff 0.1, 0.2, 0.4 s: unos pocos intentos, no uno por escritura
+    assert i > 20
+    assert cli.requests <= 5
+
+
+def test_vista_pendiente_combina_insert_y_updates(journal):
+    j, cli = journal
+    cli.falla = ConnectionError("caído")
+    _insert(j, "a")
+    j.registrar("observacion", "update", {"estado": "finalizada"},
+                filtro=[["id_observacion", "a"]], ref="a")
+    j.replay()
+
+    assert j.vista_pendiente("observacion") == {
+        "a": {"id_observacion": "a", "objeto_celeste": "M42", "estado": "finalizada"},
+    }
+    cli.falla = None
+    j.replay()
+    assert j.vista_pendiente("observacion") == {}
+
+
+def test_foto_en_disco_se_sube_en_orden_y_se_borra(journal, tmp_path):
+    j, cli = journal
+    archivo = tmp_path / "obs-a.jpg"
+    archivo.write_bytes(b"\xff\xd8jpeg")
+    cli.falla = ConnectionError("caído")
+
+    _insert(j, "a")
+    j.registrar("fotos", "subir", {"archivo": str(archivo), "path": "obs/a.jpg",
+                                  "content_type": "image/jpeg"}, ref="a")
+    j.registrar("observacion", "update", {"foto_path": "obs/a.jpg"},
+                filtro=[["id_observacion", "a"]], ref="a")
+    j.replay()
+    assert archivo.exists() and cli.subidas == {}
+
+    cli.falla = None
+    assert j.replay() == 3
+    assert cli.subidas == {("fotos", "obs/a.jpg"): b"\xff\xd8jpeg"}
+    assert cli.escritas[-1] == {"foto_path": "obs/a.jpg"}
+    assert not archivo.exists()
+
+
+def test_foto_sin_archivo_se_descarta(journal, tmp_path):
+    j, cli = journal
+    j.registrar("fotos", "subir", {"archivo": str(tmp_path / "no.jpg"), "path": "x.jpg"}, ref="a")
+    j.replay()
+    assert j.metricas()["descartados"] == 1
@@ -0,0 +1,78 @@
+import time
+
+import lotes
+from estado import EstadoLocal
+from lotes import Planificador
+
+
+class _Journal:
+    def __init__(self):
+        self.escrituras = []
+
+    def registrar(self, tabla, op, datos, **kw):
+        self.escrituras.append((tabla, op, datos, kw))
+
+
+class _Resp:
+    def __init__(self, data=None):
+        self.data = data or {}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+def _esperar_fin(p, id_lote):
+    limite = time.monotonic() + 5
+    while time.monotonic() < limite:
+        prog = p.progreso(id_lote)
+        if prog["estado"] == "finalizado":
+            return prog
+        time.sleep(0.02)
+    raise AssertionError("el lote no terminó")
+
+
+def _planificador(monkeypatch, ctrl, sesion_vigente=None):
+    def get(url, params=None, timeout=None):
+        return _Resp(ctrl if url.endswith("/apuntar") else None)
+
+    monkeypatch.setattr(lotes.requests, "get", get)
+    fotos = []
+    p = Planificador(_Journal(), EstadoLocal(), lambda tipo, tel: f"http://{tipo}",
+                     lambda id_obs, tel, objeto: fotos.append(id_obs),
+                     estabilizar_seg=0, sesion_vigente=sesion_vigente)
+    return p, fotos
+
+
+def test_sin_mover_el_domo_avisa_y_toma_la_foto(monkeypatch):
+    p, fotos = _planificador(monkeypatch, {"azimut": 10, "altitud": 40, "mueve": False,
+                                           "razon": "Fuera de rango del domo"})
+    id_lote = p.crear_lote("u", {1: ["M42"]}, {1: "s"})
+    prog = _esperar_fin(p, id_lote)
+
+    obj = prog["objetivos"][0]
+    assert obj["estado"] == "finalizado"
+    assert obj["error"] == "Fuera de rango del domo"
+    assert fotos == [obj["id_observacion"]]
+
+
+def test_sesion_cerrada_cancela_el_resto(monkeypatch):
+    llamadas = []
+    p, fotos = _planificador(monkeypatch, {"azimut": 10, "altitud": 40},
+                             sesion_vigente=lambda s, u: llamadas.append(s) or len(llamadas) < 2)
+    id_lote = p.crear_lote("u", {1: ["M42", "Vega", "Rigel"]}, {1: "s"})
+    prog = _esperar_fin(p, id_lote)
+
+    assert [o["estado"] for o in prog["objetivos"]] == ["finalizado", "cancelado", "cancelado"]
+    assert len(fotos) == 1
+
+
+def test_lote_terminado_sale_de_memoria(monkeypatch):
+    p, _ = _planificador(monkeypatch, {"azimut": 10, "altitud": -5})
+    id_lote = p.crear_lote("u", {1: ["M42"]}, {1: "s"})
+    prog = _esperar_fin(p, id_lote)
+
+    assert prog["objetivos"][0]["estado"] == "omitido"
+    assert p._lotes == {}
@@ -0,0 +1,82 @@
+import uuid
+
+import pytest
+
+import app as app_mod
+from journal import Journal
+
+# Con Supabase caído (journal sin reenviar) la observación sigue: se
+# recupera al recargar la página y la foto se baja igual.
+
+
+class _Vacia:
+    data = []
+
+    def __getattr__(self, _):
+        return lambda *a, **k: self
+
+    def execute(self):
+        return self
+
+
+class _SinFilas:
+    def table(self, _):
+        return _Vacia()
+
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    j = Journal(str(tmp_path / "journal.db"), _SinFilas())
+    j._asegurar_hilo = lambda: None     # Supabase "caído": nada se reenvía
+    monkeypatch.setattr(app_mod, "journal", j)
+    monkeypatch.setattr(app_mod, "sb_admin", _SinFilas())
+    monkeypatch.setattr(app_mod, "FOTOS_SPOOL_DIR", str(tmp_path / "fotos"))
+    c = app_mod.app.test_client()
+    with c.session_transaction() as s:
+        s["email"] = "a@b.c"
+        s["user_id"] = "u-1"
+    return c, j
+
+
+def _abrir(j, id_sesion):
+    j.registrar("observacion", "upsert", {
+        "id_observacion": "obs-1", "id_sesion": id_sesion, "estado": "en curso",
+        "objeto_celeste": "M42 Orión", "usuario_control": "u-1",
+        "fecha_inicio": "2026-10-19T08:00:00+00:00",
+    }, conflicto="id_observacion", ref="obs-1")
+
+
+def test_activa_incluye_insert_pendiente(cliente):
+    c, j = cliente
+    id_sesion = str(uuid.uuid4())
+    _abrir(j, id_sesion)
+
+    data = c.get(f"/api/observacion/activa/{id_sesion}").get_json()["data"]
+    assert data["id_observacion"] == "obs-1"
+
+    j.registrar("observacion", "update", {"estado": "finalizada"},
+                filtro=[["id_observacion", "obs-1"]], ref="obs-1")
+    assert c.get(f"/api/observacion/activa/{id_sesion}").get_json()["data"] is None
+
+
+class _Foto:
+    status_code = 200
+    content = b"\xff\xd8" + b"0" * 6000
+
+
+def test_finalizar_baja_la_foto_sin_esperar_a_supabase(cliente, monkeypatch, tmp_path):
+    c, j = cliente
+    id_sesion = str(uuid.uuid4())
+    _abrir(j, id_sesion)
+    monkeypatch.setattr(app_mod, "obtener_url_controlador", lambda *a: "http://cam")
+    monkeypatch.setattr(app_mod.requests, "get", lambda *a, **k: _Foto())
+
+    res = c.post("/api/observacion/finalizar", json={"id_sesion": id_sesion}).get_json()
+    assert res["ok"] is True and res["warning"] is None
+
+    foto = tmp_path / "fotos" / "obs-1.jpg"
+    assert foto.read_bytes() == _Foto.content
+    pendiente = j.vista_pendiente("observacion")["obs-1"]
+    assert pendiente["estado"] == "finalizada"
+    assert "/m42_orión_" in pendiente["foto_path"]
+    assert j.vista_pendiente(app_mod.BUCKET_FOTOS)["obs-1"]["archivo"] == str(foto)
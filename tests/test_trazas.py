@@ -0,0 +1,25 @@
+import time
+
+from trazas import Trazas
+
+
+def test_resumen_solo_mira_la_ventana(tmp_path):
+    tr = Trazas(str(tmp_path / "trazas.db"))
+    ahora = time.time()
+    tr.registrar("vieja", "foto", ahora - 3 * 3600, 900.0, id_telescopio=1)
+    tr.registrar("nueva", "foto", ahora - 60, 100.0, id_telescopio=2)
+    tr.registrar("nueva", "journal", ahora - 30, 50.0, origen="journal")
+
+    res = tr.resumen(desde_seg=3600)
+    assert set(res) == {"2"}
+    assert {e["etapa"]: e["n"] for e in res["2"]} == {"foto": 1, "journal": 1}
+
+
+def test_purga_periodica(tmp_path, monkeypatch):
+    tr = Trazas(str(tmp_path / "trazas.db"))
+    tr.registrar("vieja", "foto", time.time() - 8 * 24 * 3600, 1.0)
+    assert tr.cascada("vieja")
+
+    monkeypatch.setattr(tr, "_ultima_purga", tr._ultima_purga - 2 * 3600)
+    tr.registrar("nueva", "foto", time.time(), 1.0)
+    assert tr.cascada("vieja") == []
@@ -0,0 +1,145 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# Trazas de latencia por observación.
+# Cada etapa del camino apuntar -> capturar -> subir deja un span con su
+# duración y bytes, correlacionado por id_observacion, en un SQLite local.
+# Con eso se arma la cascada de una observación y el resumen por telescopio
+# de qué etapa domina.
+
+RETENCION_SEG = 7 * 24 * 3600
+PURGA_CADA_SEG = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS span (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_observacion TEXT NOT NULL,
+    etapa          TEXT NOT NULL,
+    inicio         REAL NOT NULL,
+    duracion_ms    REAL NOT NULL,
+    bytes          INTEGER,
+    id_telescopio  INTEGER,
+    origen         TEXT NOT NULL,
+    error          TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_span_obs ON span (id_observacion, inicio);
+CREATE INDEX IF NOT EXISTS ix_span_inicio ON span (inicio);
+"""
+
+
+class Trazas:
+    def __init__(self, path: str):
+        self.path = path
+        self._ultima_purga = 0.0
+        with self._conn() as c:
+            c.executescript(_SCHEMA)
+        self._purgar()
+
+    def _purgar(self):
+        # en el arranque y luego cada PURGA_CADA_SEG desde registrar()
+        self._ultima_purga = time.monotonic()
+        with self._conn() as c:
+            c.execute("DELETE FROM span WHERE inicio < ?", (time.time() - RETENCION_SEG,))
+
+    @contextmanager
+    def _conn(self):
+        c = sqlite3.connect(self.path, timeout=10)
+        try:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            with c:
+                yield c
+        finally:
+            c.close()
+
+    def registrar(self, id_observacion, etapa: str, inicio: float, duracion_ms: float,
+                  bytes_: int = None, id_telescopio=None, origen: str = "backend",
+                  error: str = None):
+        try:
+            if time.monotonic() - self._ultima_purga > PURGA_CADA_SEG:
+                self._purgar()
+            with self._conn() as c:
+                c.execute(
+                    "INSERT INTO span (id_observacion, etapa, inicio, duracion_ms, bytes, "
+                    "id_telescopio, origen, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (str(id_observacion), etapa, inicio, round(duracion_ms, 3), bytes_,
+                     id_telescopio, origen, error),
+                )
+        except Exception as e:
+            # trazar nunca debe romper la observación
+            print("No se pudo guardar span:", e)
+
+    @contextmanager
+    def span(self, id_observacion, etapa: str, id_telescopio=None):
+        """Mide el bloque. El llamador puede fijar sp["bytes"]."""
+        sp = {"bytes": None}
+        inicio = time.time()
+        t = time.perf_counter()
+        error = None
+        try:
+            yield sp
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self.registrar(id_observacion, etapa, inicio, (time.perf_counter() - t) * 1000,
+                           sp["bytes"], id_telescopio, error=error)
+
+    # ---------- lectura ----------
+
+    def cascada(self, id_observacion) -> list:
+        """Spans de una observación en orden, con su desfase desde el primero."""
+        with self._conn() as c:
+            filas = c.execute(
+                "SELECT etapa, inicio, duracion_ms, bytes, id_telescopio, origen, error "
+                "FROM span WHERE id_observacion = ? ORDER BY inicio",
+                (str(id_observacion),),
+            ).fetchall()
+        if not filas:
+            return []
+
+        t0 = filas[0][1]
+        return [{
+            "etapa": etapa,
+            "offset_ms": round((inicio - t0) * 1000, 1),
+            "duracion_ms": dur,
+            "bytes": b,
+            "id_telescopio": tel,
+            "origen": origen,
+            "error": error,
+        } for etapa, inicio, dur, b, tel, origen, error in filas]
+
+    def resumen(self, desde_seg: float = 24 * 3600) -> dict:
+        """Por telescopio y etapa: n, promedio y máximo en ms, de más lenta a más rápida.
+
+        El telescopio de una observación es el que haya informado cualquiera
+        de sus spans (no todas las etapas lo conocen)."""
+        desde = time.time() - desde_seg
+        with self._conn() as c:
+            filas = c.execute(
+                """
+                SELECT COALESCE(t.id_telescopio, -1) AS tel, s.etapa,
+                       COUNT(*), AVG(s.duracion_ms), MAX(s.duracion_ms), AVG(s.bytes)
+                FROM span s
+                LEFT JOIN (
+                    SELECT id_observacion, MAX(id_telescopio) AS id_telescopio
+                    FROM span WHERE inicio >= ? GROUP BY id_observacion
+                ) t ON t.id_observacion = s.id_observacion
+                WHERE s.inicio >= ?
+                GROUP BY tel, s.etapa
+                ORDER BY tel, AVG(s.duracion_ms) DESC
+                """,
+                (desde, desde),
+            ).fetchall()
+
+        out = {}
+        for tel, etapa, n, prom, mx, prom_bytes in filas:
+            out.setdefault(str(tel) if tel >= 0 else "desconocido", []).append({
+                "etapa": etapa,
+                "n": n,
+                "promedio_ms": round(prom, 1),
+                "max_ms": round(mx, 1),
+                "promedio_bytes": int(prom_bytes) if prom_bytes is not None else None,
+            })
+        return out